@@ -1,5 +1,4 @@
 import hashlib
-import yaml
 import re
 
 from django import http, template
@@ -8,6 +7,9 @@ from django.core.urlresolvers import resolve
 from skylark import HttpResponse, RequestContext
 from skylark.conf import settings
 from skylark.instructions import PageInstructions
+from skylark import resolver
+from skylark.utils import yamlloader
+from skylark.utils.lru import LRUCache
 from skylark import renderer
 from skylark import chirp
 from skylark.chirp import check_instrumentation
@@ -39,6 +41,41 @@ class HandlerError(Exception):
     pass
 
 
+def cache_key_value(value):
+    """
+    What stands for value in the key of the page instructions cache.  Raises
+    TypeError if value can't be compared by what it holds, an object that is
+    only equal to itself would never be found again.  QuerySets are like this,
+    so they are never evaluated just to make a key.
+
+    Lists, tuples, dictionaries, and sets go by the same rule for everything
+    they hold.
+    """
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + \
+            tuple([cache_key_value(i) for i in value])
+
+    if isinstance(value, dict):
+        return ('dict', frozenset([(cache_key_value(k), cache_key_value(v))
+            for k, v in value.items()]))
+
+    if isinstance(value, (set, frozenset)):
+        return ('set', frozenset([cache_key_value(i) for i in value]))
+
+    if getattr(type(value), '__hash__', None) is object.__hash__:
+        # Not %r, for a QuerySet that would run the query
+        raise TypeError('%s objects are only equal to themselves' % (
+            type(value).__name__,))
+
+    try:
+        hash(value)
+    except TypeError:
+        raise TypeError('%s objects can not be part of a key' % (
+            type(value).__name__,))
+
+    return value
+
+
 class BaseAssembly(object):
     """
     The yaml files we were constructed with, this probably came from a Django
@@ -62,7 +99,16 @@ class BaseAssembly(object):
     """
     _page_assembly_handlers = []
 
-    def __init__(self, yamlfiles, context):
+    """
+    The context variables the yaml files depend on.  If this is None the page
+    instructions are built from scratch every time, otherwise they are cached
+    and reused as long as these variables and the yaml files stay the same.
+    """
+    cache_vars = None
+
+    __page_instructions_cache = LRUCache(1000)
+
+    def __init__(self, yamlfiles, context, cache_vars=None):
         if not hasattr(self, 'render_full_page'):
             raise ValueError('You must set render_full_page to True '
                 'or False on the subclass of BaseAssembly')
@@ -89,6 +135,9 @@ class BaseAssembly(object):
 
         self.yamlfiles = yamlfiles
 
+        if cache_vars is not None:
+            self.cache_vars = tuple(cache_vars)
+
         # It's important for our context to have the media root and url
         # included, if it's not there we are going to add it
         for var in ('MEDIA_ROOT', 'MEDIA_URL'):
@@ -132,17 +181,71 @@ class BaseAssembly(object):
         """
         Combines all the files and instructions into one object
         """
+        if self.cache_vars is not None:
+            return self.__get_cached_page_instructions()
+
+        return self.__build_page_instructions()
+
+    def __build_page_instructions(self):
         page_instructions = PageInstructions(
             render_full_page=self.render_full_page,
             context_instance=self.context)
 
-        tried = []
-
         for file in self.yamlfiles:
             self.add_page_instructions(page_instructions, file)
 
         return page_instructions
 
+    def __get_cache_key(self):
+        """
+        The page instructions depend on the yaml files, how we are rendering,
+        and the values of the context variables listed in cache_vars.  Gives
+        back None if one of the values can't be part of a key.
+        """
+        values = []
+        for var in self.cache_vars:
+            try:
+                value = template.Variable(var).resolve(self.context)
+            except template.VariableDoesNotExist:
+                value = None
+
+            try:
+                values.append(cache_key_value(value))
+            except TypeError:
+                return None
+
+        return (tuple(self.yamlfiles), self.render_full_page, self.cache_vars,
+            tuple(values))
+
+    def __get_cached_page_instructions(self):
+        """
+        Reuses page instructions that were built for the same yaml files and
+        context variables, as long as none of the yaml files have changed
+        """
+        cache = self.__page_instructions_cache
+        key = self.__get_cache_key()
+
+        if key is None:
+            return self.__build_page_instructions()
+
+        entry = cache.get(key)
+        if entry is not None:
+            cached, mtimes = entry
+            if resolver.mtimes_are_current(mtimes):
+                return cached.copy(self.context)
+
+        page_instructions = self.__build_page_instructions()
+        mtimes = resolver.get_mtimes(page_instructions.yaml)
+        # Keep our own copy, the one we return is going to be modified by the
+        # plans and snippets
+        cache.set(key, (page_instructions.copy(), mtimes))
+
+        return page_instructions
+
+    @staticmethod
+    def clear_page_instructions_cache():
+        BaseAssembly.__page_instructions_cache.clear()
+
     def __convert_tidy_errors(self, errors_raw, **kwargs):
         """
         The errors we get back from the tidy are formatted for output including
@@ -187,7 +290,7 @@ class BaseAssembly(object):
         sourcerendered = source.render(self.context)
         assert sourcerendered, 'yamlfile needs to contain something'
 
-        instructions = yaml.load(sourcerendered)
+        instructions = yamlloader.load(sourcerendered)
         page_instructions.add(instructions, file)
 
     @check_instrumentation
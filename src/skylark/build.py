@@ -0,0 +1,228 @@
+"""
+Prepares media ahead of time, outside of the request/response cycle.
+
+The plans normally do their work (copying, processing, rolling up) the first
+time somebody asks for a page.  The skylark_build management command runs the
+active plan for every page we know about and writes what it prepared to a JSON
+manifest.  With SKYLARK_USE_BUILD_MANIFEST turned on the plans will use the
+manifest instead of touching the file system.
+
+Pages can be built in a pool of processes, one page per process at a time.
+The rollups they write are named by their content and built under a lock (see
+skylark.utils.lock) so two pages sharing a rollup don't get in each other's
+way.
+"""
+import json
+import pickle
+import multiprocessing
+
+from django.http import HttpRequest
+
+from skylark.conf import settings
+from skylark import resolver
+from skylark.utils import publish
+from skylark.utils import yamlloader
+
+__manifest = None
+
+
+def get_entry_points():
+    """
+    The YAML files we build media for.  This comes from SKYLARK_BUILD_YAML,
+    if that is empty we look for every YAML file in the template directories
+    that has a body (in other words, a page and not something that is only
+    pulled in with uses)
+    """
+    if settings.SKYLARK_BUILD_YAML:
+        return list(settings.SKYLARK_BUILD_YAML)
+
+    entry_points = []
+    for name, filepath in sorted(resolver.get_index().items()):
+        if not name.endswith('.yaml'):
+            continue
+        f = open(filepath)
+        try:
+            try:
+                document = yamlloader.load(f.read())
+            except Exception:
+                # Probably a template tag in there, the plan will tell us
+                # what's wrong when we try to build it
+                document = {'body': None}
+        finally:
+            f.close()
+        if isinstance(document, dict) and 'body' in document:
+            entry_points.append(name)
+
+    return entry_points
+
+
+def get_request():
+    """
+    A stand in for the request when we don't have a real one
+    """
+    request = HttpRequest()
+    request.path = '/'
+    request.META = {
+        'REMOTE_ADDR': '127.0.0.1',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80'}
+    return request
+
+
+def get_manifest_key(plan, yamlfiles):
+    return '%s:%s' % (plan.__class__.__name__, ','.join(yamlfiles))
+
+
+def build_entry_point(yamlfiles):
+    """
+    Runs the active plan for the page made up of yamlfiles, giving back the
+    manifest key and the prepared media
+    """
+    from skylark import RequestContext
+    from skylark import plans
+    from skylark.page import PageAssembly
+    from skylark.instructions import PageInstructions
+
+    if isinstance(yamlfiles, basestring):
+        yamlfiles = (str(yamlfiles),)
+
+    context = RequestContext(get_request())
+    assembly = PageAssembly(yamlfiles, context)
+
+    page_instructions = PageInstructions(render_full_page=True,
+        context_instance=context)
+    for file in assembly.yamlfiles:
+        assembly.add_page_instructions(page_instructions, file)
+
+    key_yaml = list(page_instructions.yaml)
+
+    plan = plans.get_for_context(context, True)
+    plan.prepare_media(page_instructions)
+
+    prepared = {}
+    for attr in ('js', 'css', 'chirp',):
+        prepared[attr] = []
+        for item in plan.prepared_instructions[attr]:
+            if 'inline' in item:
+                # This gets rendered again on each request
+                item = dict(item)
+                item.pop('source', None)
+            prepared[attr].append(item)
+
+    return get_manifest_key(plan, key_yaml), prepared
+
+
+def get_jobs(jobs=None):
+    """
+    How many processes to build with, None or 0 means one for each CPU
+    """
+    if not jobs:
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+    return jobs
+
+
+def _build_entry_point(entry_point):
+    """
+    build_entry_point for the pool, failures come back instead of being raised
+    so one bad page doesn't stop the others.  Exceptions that can't be pickled
+    are replaced with one that can.
+    """
+    try:
+        key, prepared = build_entry_point(entry_point)
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = Exception('%s: %s' % (e.__class__.__name__, e))
+        return entry_point, None, None, e
+    return entry_point, key, prepared, None
+
+
+def build_entry_points(entry_points, jobs=1):
+    """
+    Builds each entry point, in a pool of jobs processes if there is more than
+    one.  Gives back (entry point, manifest key, prepared media, exception)
+    for each of them, in order.
+    """
+    jobs = min(get_jobs(jobs), len(entry_points))
+
+    if jobs <= 1:
+        return [_build_entry_point(i) for i in entry_points]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(_build_entry_point, entry_points, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def warm_up(entry_points=None, jobs=None):
+    """
+    Prepares the media for entry_points, or every page we can find, without
+    writing a manifest.  Run this when a server starts so the first requests
+    find their rollups already built.  Gives back a list of (entry point,
+    exception) for the ones that failed.
+    """
+    if entry_points is None:
+        entry_points = get_entry_points()
+
+    return [(entry_point, error) for entry_point, key, prepared, error in
+        build_entry_points(entry_points, jobs) if error is not None]
+
+
+def build_manifest(entry_points, filename=None, jobs=1):
+    """
+    Builds every entry point and writes the manifest.  Gives back a list of
+    (entry point, exception) for the ones that failed.
+
+    jobs is the number of processes to build with, see get_jobs.
+    """
+    filename = filename or settings.SKYLARK_BUILD_MANIFEST
+
+    manifest = {}
+    errors = []
+    for entry_point, key, prepared, error in \
+            build_entry_points(entry_points, jobs):
+        if error is not None:
+            errors.append((entry_point, error))
+            continue
+        manifest[key] = prepared
+
+    publish.write_file(filename,
+        json.dumps(manifest, indent=1, sort_keys=True))
+
+    clear_manifest()
+
+    return errors
+
+
+def get_manifest():
+    """
+    The manifest is read once per process
+    """
+    global __manifest
+    if __manifest is None:
+        try:
+            f = open(settings.SKYLARK_BUILD_MANIFEST)
+            try:
+                __manifest = json.load(f)
+            finally:
+                f.close()
+        except IOError:
+            __manifest = {}
+    return __manifest
+
+
+def clear_manifest():
+    global __manifest
+    __manifest = None
+
+
+def get_manifest_entry(plan, page_instructions):
+    return get_manifest().get(
+        get_manifest_key(plan, list(page_instructions.yaml)))
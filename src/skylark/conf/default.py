@@ -1,6 +1,4 @@
 import os
-from random import sample
-import string
 
 from django.conf import settings as django_settings
 from urlparse import urljoin
@@ -11,10 +9,32 @@ SKYLARK_CACHE_URL = urljoin(django_settings.MEDIA_URL, 'cfcache/')
 SKYLARK_INIT_CLEAR_CACHE = False
 SKYLARK_PLANS = 'mediadeploy'
 SKYLARK_PLANS_DEFAULT = 'default'
-SKYLARK_PLANS_ROLLUP_SALT = ''.join(sample(string.hexdigits, 16))
+SKYLARK_PLANS_ROLLUP_SALT = ''
 SKYLARK_ENABLE_TIDY = False   # For now until tidylib catches up with html5
 SKYLARK_RAISE_CSS_ERRORS = django_settings.DEBUG
 SKYLARK_RAISE_HTML_ERRORS = django_settings.DEBUG
+SKYLARK_PUBLISH_STRATEGY = 'copy'   # 'copy', 'hardlink', or 'symlink'
+
+# Processed media
+SKYLARK_MEDIA_CACHE = 'locmem'   # 'locmem', 'disk', 'django', or a class
+SKYLARK_MEDIA_CACHE_MAX_ENTRIES = 500
+SKYLARK_MEDIA_CACHE_MAX_BYTES = 32 * 1024 * 1024
+SKYLARK_MEDIA_CACHE_DIRECTORY = None   # Required for 'disk', not in MEDIA_ROOT
+SKYLARK_MEDIA_CACHE_DISK_MAX_BYTES = 256 * 1024 * 1024
+SKYLARK_CLEVERCSS_CACHE_DIRECTORY = None   # Private, not in MEDIA_ROOT
+
+# YAML parsing
+SKYLARK_YAML_LOADER = None   # Fastest safe loader available
+SKYLARK_YAML_CACHE_SIZE = 200
+
+# Building media ahead of time with skylark_build
+SKYLARK_BUILD_YAML = ()   # Empty means look for them
+SKYLARK_BUILD_MANIFEST = os.path.join(SKYLARK_CACHE_ROOT, 'manifest.json')
+SKYLARK_USE_BUILD_MANIFEST = False
+
+# Watching the files behind rollups instead of checking them on each request
+SKYLARK_MEDIA_WATCHER = None   # None, 'auto', 'inotify', or 'poll'
+SKYLARK_MEDIA_WATCHER_INTERVAL = 1.0   # Seconds between polls
 
 # Dojo toolkit related
 SKYLARK_DOJO_DEBUGATALLCOSTS = django_settings.DEBUG
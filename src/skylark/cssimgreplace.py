@@ -54,33 +54,94 @@ url_value_re = re.compile(r"""
       """, re.VERBOSE)
 
 
-def relative_replace(source, css_path, cache_base_url):
-    urls_replaced = []   # List of urls we've already replaced so we can skip
-    replacement = source
+def _is_absolute(url):
+    # data: URIs are as absolute as they come
+    return url.startswith('http') or url.startswith('https') or \
+        url.startswith('/') or url.startswith('data:')
+
+
+def referenced_paths(source, css_path):
+    """
+    The files the relative url() values in source point at, as if source
+    lived in css_path.  Each path is only given once, in the order they first
+    show up, without any query string or fragment.
+    """
+    paths = []
+    seen = set()
     for match in url_value_re.finditer(source):
-        url_value = match.group()
-        if url_value in urls_replaced:
-            # We've already replaced this one
+        url = match.group(2).strip()
+        if not url or _is_absolute(url):
             continue
-        urls_replaced.append(url_value)
-        
+        url = url.split('#', 1)[0].split('?', 1)[0]
+        path = normpath('/'.join((css_path, url,)))
+        if path not in seen:
+            seen.add(path)
+            paths.append(path)
+    return paths
+
+
+def relative_replace(source, css_path, cache_base_url):
+    """
+    Points the relative url() values in source at cache_base_url, as if source
+    lived in css_path.  The stylesheet is only gone through once, each url
+    value is worked out the first time we see it and remembered after that.
+    """
+    replacements = {}
+
+    def replace(match):
+        url_value = match.group()
+        try:
+            return replacements[url_value]
+        except KeyError:
+            pass
+
         # The url under question
         url = match.group(2)
 
-        if url.startswith('http') or url.startswith('https') or \
-           url.startswith('/'):
+        if _is_absolute(url):
             # We need to leave this sucker alone, it's not the droids that we
-            # are looking for.  It's either an absolute url or 
+            # are looking for.  It's either an absolute url or
             # fully-qualified.
-            continue
+            new_value = url_value
+        else:
+            # We are going to borrow os.path.normpath to fix any double
+            # slashes or any ../ parts
+            full_path = normpath('/'.join((css_path, url,)))
+            new_value = 'url(%s%s%s%s)' % (match.group(1) or '',
+                cache_base_url, full_path, match.group(4) or '')
+
+        replacements[url_value] = new_value
+        return new_value
+
+    return url_value_re.sub(replace, source)
+
+
+def inline_replace(source, base_url, data_uri):
+    """
+    Embeds files in source.  Each url() value that starts with base_url is
+    passed to data_uri without it, if that gives back a data: URI it takes the
+    place of the url.  This goes after relative_replace, which points every
+    relative url at the cache.
+    """
+    replacements = {}
+
+    def replace(match):
+        url_value = match.group()
+        try:
+            return replacements[url_value]
+        except KeyError:
+            pass
+
+        url = match.group(2)
+        new_value = url_value
 
-        full_path = normpath('/'.join((css_path, url,)))
-        new_url_value = '%s%s' % (cache_base_url, full_path)
+        if url.startswith(base_url):
+            uri = data_uri(url[len(base_url):])
+            if uri is not None:
+                new_value = 'url(%s%s%s)' % (match.group(1) or '', uri,
+                    match.group(4) or '')
 
-        # We are going to borrow os.path.normpath to fix any double slashes or
-        # any ../ parts
-        replacement = replacement.replace(url_value,
-            'url(%s%s%s)' % (match.group(1) or '', new_url_value,
-                             match.group(4) or ''))
+        replacements[url_value] = new_value
+        return new_value
 
-    return replacement
+    return url_value_re.sub(replace, source)
@@ -1,8 +1,9 @@
 import copy
-import yaml
 
 from django import template
 
+from skylark.utils import yamlloader
+
 
 class StringWithSourcefile(object):
     """
@@ -19,14 +20,40 @@ class StringWithSourcefile(object):
         return self.value.__call__(f)
 
 
+def media_property(attr):
+    """
+    The js, css, and chirp lists are kept alongside an index of their source
+    attributes.  Assigning a new list to one of them rebuilds the index.
+    """
+    def getter(self):
+        return self._media[attr]
+
+    def setter(self, value):
+        self._media[attr] = value
+        self._reindex(attr)
+
+    return property(getter, setter)
+
+
 class PageInstructions(object):
     """
     Object to contain the page instructions that come from our YAML files
     """
+    js = media_property('js')
+    css = media_property('css')
+    chirp = media_property('chirp')
+
     def __init__(self, **kwargs):
         self.render_full_page = kwargs.get('render_full_page', True)
         self.context = kwargs.get('context_instance', template.Context())
 
+        """
+        For each kind of media, a count of the parts that reference each
+        source.  This is what makes part_exists fast.
+        """
+        self._media = {}
+        self._source_index = {}
+
         """
         These are the ones we expect, these are all the possible kinds of
         instructions that can be handled
@@ -43,24 +70,88 @@ class PageInstructions(object):
         self.meta = []
         self.chirp = []
 
+    def copy(self, context_instance=None):
+        """
+        Makes a deep copy of these instructions that is bound to
+        context_instance instead of our own context.
+
+        The plans and the snippets modify the page instructions as they work
+        with them, so anything that wants to hang on to a set of instructions
+        should hand out copies.
+        """
+        if context_instance is None:
+            context_instance = template.Context()
+
+        duplicate = PageInstructions(render_full_page=self.render_full_page,
+            context_instance=context_instance)
+
+        for attr in ('root_yaml', 'doctype', 'body', 'title', 'uses_yaml',
+                     'other_yaml', 'piped_yaml', 'js', 'css', 'meta',
+                     'chirp',):
+            setattr(duplicate, attr, copy.deepcopy(getattr(self, attr)))
+
+        return duplicate
+
     def part_exists(self, part):
         """
         Withing our existing page instruction for javascript and css, we look
         to see if the part already has been added.  There is no reason to
         duplicate either one of these.
         """
-        instructions = []
-        instructions.extend(self.js)
-        instructions.extend(self.css)
-        instructions.extend(self.chirp)
-
-        for instruction in instructions:
-            if self._get_source_attribute(instruction) == \
-               self._get_source_attribute(part):
-                return True
+        source = self._get_source_attribute(part)
+
+        try:
+            for index in self._source_index.values():
+                if source in index:
+                    return True
+        except TypeError:
+            # Not something we can hash, do it the long way
+            for attr in ('js', 'css', 'chirp',):
+                for instruction in getattr(self, attr):
+                    if self._get_source_attribute(instruction) == source:
+                        return True
 
         return False
 
+    def _reindex(self, attr):
+        self._source_index[attr] = {}
+        for part in self._media[attr]:
+            self._index_part(attr, part)
+
+    def _index_part(self, attr, part):
+        index = self._source_index[attr]
+        source = self._get_source_attribute(part)
+        try:
+            index[source] = index.get(source, 0) + 1
+        except TypeError:
+            # Unhashable, part_exists will have to find it the slow way
+            pass
+
+    def _unindex_part(self, attr, part):
+        index = self._source_index[attr]
+        source = self._get_source_attribute(part)
+        try:
+            if index.get(source, 0) > 1:
+                index[source] -= 1
+            else:
+                index.pop(source, None)
+        except TypeError:
+            pass
+
+    def append_part(self, attr, part):
+        """
+        Adds a part to the end of the js, css, or chirp list
+        """
+        self._media[attr].append(part)
+        self._index_part(attr, part)
+
+    def remove_part(self, attr, part):
+        """
+        Removes a part from the js, css, or chirp list
+        """
+        self._media[attr].remove(part)
+        self._unindex_part(attr, part)
+
     def _get_source_attribute(self, part):
         """
         Looks through a part of the yaml file and pulls out the location it
@@ -82,7 +173,6 @@ class PageInstructions(object):
         for attr in ('js', 'css', 'chirp',):
             media = getattr(self, attr)
             to_remove = []
-            dest_media = getattr(destination_instructions, attr)
 
             if not media:
                 continue
@@ -95,10 +185,10 @@ class PageInstructions(object):
                 if part['sourcefile'] not in destination_instructions.yaml:
                     destination_instructions.piped_yaml.append(
                         part['sourcefile'])
-                dest_media.append(part)
+                destination_instructions.append_part(attr, part)
 
             for part in to_remove:
-                media.remove(part)
+                self.remove_part(attr, part)
 
     @property
     def yaml(self):
@@ -122,7 +212,7 @@ class PageInstructions(object):
         sourcerendered = source.render(context)
         assert sourcerendered, 'yamlfile needs to contain something'
 
-        return yaml.load(sourcerendered)
+        return yamlloader.load(sourcerendered)
 
     def add(self, instructions, sourcefile, **kwargs):
         if not self.root_yaml:
@@ -171,6 +261,10 @@ class PageInstructions(object):
                                 if self.part_exists(part):
                                     continue
 
+                                part['sourcefile'] = sourcefile
+                                self.append_part(attr, part)
+                                continue
+
                             part['sourcefile'] = sourcefile
                             pi_object.append(part)
                     else:
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from skylark import build
+from skylark.conf import settings
+
+
+class Command(BaseCommand):
+    help = ("Runs the media plan for your pages ahead of time and writes a "
+        "manifest of the prepared media.  Set SKYLARK_USE_BUILD_MANIFEST to "
+        "True to have the plans use it.  With --warm-up the media is "
+        "prepared but no manifest is written.")
+
+    args = '[yamlfile ...]'
+
+    option_list = BaseCommand.option_list + (
+        make_option("--manifest", "-m", dest="manifest",
+            help="Where to write the manifest, defaults to "
+                "SKYLARK_BUILD_MANIFEST"),
+        make_option("--jobs", "-j", dest="jobs", type="int", default=0,
+            help="How many pages to build at once, each in its own process. "
+                "Defaults to one process for each CPU, 1 builds them one at "
+                "a time in this process"),
+        make_option("--warm-up", "-w", dest="warm_up", action="store_true",
+            default=False,
+            help="Build the rollups and fill the media cache without writing "
+                "a manifest"),
+    )
+
+    def handle(self, *args, **options):
+        manifest = options.get('manifest') or settings.SKYLARK_BUILD_MANIFEST
+
+        entry_points = list(args) or build.get_entry_points()
+
+        if not entry_points:
+            raise CommandError("Could not find any pages to build, list them "
+                "in SKYLARK_BUILD_YAML")
+
+        if options.get('jobs') < 0:
+            raise CommandError("--jobs can't be negative")
+
+        if options.get('warm_up'):
+            errors = build.warm_up(entry_points, jobs=options.get('jobs'))
+        else:
+            errors = build.build_manifest(entry_points, manifest,
+                jobs=options.get('jobs'))
+
+        for entry_point, error in errors:
+            print self.style.ERROR("Could not build %s: %s" % (
+                entry_point, error))
+
+        if options.get('warm_up'):
+            print self.style.NOTICE("Warmed up %d of %d pages" % (
+                len(entry_points) - len(errors), len(entry_points)))
+        else:
+            print self.style.NOTICE("Built %d of %d pages into %s" % (
+                len(entry_points) - len(errors), len(entry_points), manifest))
@@ -1,22 +1,73 @@
 import copy
 import os
 import re
-import filecmp
-import shutil
+import base64
 import hashlib
+import mimetypes
 import pickle
+import threading
 from urlparse import urljoin
 
 from django.template import Template, TemplateDoesNotExist
 from django.template import loader
-from django.template.loaders import filesystem
-from django.template.loaders import app_directories
-from django.utils.functional import memoize
+from django.utils.importlib import import_module
 
 from skylark.conf import settings
 from skylark.processor import clevercss
 from skylark import chirp
 from skylark import cssimgreplace
+from skylark import resolver
+from skylark import build
+from skylark.utils import mediacache
+from skylark.utils import publish
+from skylark.utils.lock import FileLock
+from skylark.utils.lru import LRUCache
+from skylark.utils import sync
+from skylark.watcher import get_watcher
+
+
+"""
+Bump this when what goes in a rollup changes in a way the code digest below
+wouldn't notice
+"""
+ROLLUP_VERSION = 1
+
+"""
+The modules that decide what goes in a rollup
+"""
+ROLLUP_MODULES = (
+    'skylark.plans.base',
+    'skylark.cssimgreplace',
+    'skylark.processor.clevercss',
+    'skylark.utils.jsmin',
+)
+
+__rollup_code_digest = None
+
+
+def get_rollup_code_digest():
+    """
+    A digest of ROLLUP_VERSION and the source of ROLLUP_MODULES, so a rollup
+    built by other code is never mistaken for one of ours.  It's the same on
+    every server running the same code.
+    """
+    global __rollup_code_digest
+
+    if __rollup_code_digest is None:
+        digest = hashlib.md5(str(ROLLUP_VERSION))
+        for name in ROLLUP_MODULES:
+            filename = import_module(name).__file__
+            if filename.endswith(('.pyc', '.pyo')) and \
+               os.path.isfile(filename[:-1]):
+                filename = filename[:-1]
+            f = open(filename, 'rb')
+            try:
+                digest.update(f.read())
+            finally:
+                f.close()
+        __rollup_code_digest = digest.hexdigest()
+
+    return __rollup_code_digest
 
 
 class BadOption(Exception):
@@ -53,10 +104,7 @@ class SkipDojoModule(Exception):
 
 
 def find_directory_from_loader(page_instructions, asset):
-    from django.template.loaders.app_directories import app_template_dirs
-    template_dirs = list(settings.TEMPLATE_DIRS) + list(app_template_dirs)
-
-    for dir in template_dirs:
+    for dir in resolver.get_template_dirs():
         asset_dir = os.path.join(dir, asset)
         if os.path.isdir(asset_dir):
             return asset_dir
@@ -65,6 +113,27 @@ def find_directory_from_loader(page_instructions, asset):
         'template directories: %s' % asset)
 
 
+def content_digest(source):
+    """
+    A digest of the source that is the same on every machine, this is what we
+    name cached files with so browsers can keep them forever
+    """
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    return hashlib.md5('%s%s' % (settings.SKYLARK_PLANS_ROLLUP_SALT,
+        source)).hexdigest()
+
+
+def fingerprint_name(template_name, source):
+    """
+    Puts a digest of the source into the name of the file
+
+        blog/media/css/screen.css -> blog/media/css/screen.0123456789ab.css
+    """
+    root, ext = os.path.splitext(template_name)
+    return '%s.%s%s' % (root, content_digest(source)[:12], ext)
+
+
 def process_clevercss(source):
     """
     This is part of the processing_funcs that Renderer will use to perform any
@@ -73,7 +142,56 @@ def process_clevercss(source):
     This particular one uses CleverCSS to process a meta-css file and convert
     it into normal css.  More info at http://sandbox.pocoo.org/clevercss/
     """
-    return clevercss.convert(source)
+    return get_clevercss_engine(source).to_css()
+
+
+def get_clevercss_engine(source):
+    """
+    Parsing is most of the work CleverCSS does, so the parsed stylesheet is
+    kept in SKYLARK_CLEVERCSS_CACHE_DIRECTORY keyed by the source.  The next
+    time we see the same source, in this process or another, it only has to be
+    evaluated.
+
+    The files are pickles, the directory has to be one that only we can write
+    to.  It's None (parse every time) unless somebody sets it.
+    """
+    directory = settings.SKYLARK_CLEVERCSS_CACHE_DIRECTORY
+    if not directory:
+        return clevercss.Engine(source)
+
+    if isinstance(source, unicode):
+        encoded = source.encode('utf-8')
+    else:
+        encoded = source
+    key = hashlib.md5('%s\0%s' % (clevercss.DUMP_VERSION,
+        encoded)).hexdigest()
+    filename = os.path.join(directory, key[:2], key)
+
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        pass
+    else:
+        try:
+            try:
+                return clevercss.Engine.loads(f.read())
+            except Exception:
+                # Cut short or written by something else, we'll parse it
+                # again and replace it
+                pass
+        finally:
+            f.close()
+
+    engine = clevercss.Engine(source)
+    publish.write_file(filename, engine.dumps())
+    return engine
+
+
+def encode_data_uri(source, mimetype):
+    """
+    The bytes in source as a data: URI
+    """
+    return 'data:%s;base64,%s' % (mimetype, base64.b64encode(source))
 
 
 def process_lessjs(source):
@@ -89,6 +207,31 @@ def process_lessjs(source):
     return source
 
 
+class PlanState(object):
+    """
+    The part of a plan that lives as long as the process.  There is one of
+    these for each plan class and cache location, shared by every render (and
+    every thread) that uses that plan.  The plan instances themselves only last
+    for one render.
+    """
+    def __init__(self, cache_prefix):
+        self.cache_root = os.path.join(
+            settings.SKYLARK_CACHE_ROOT, cache_prefix)
+        self.cache_url = urljoin(settings.SKYLARK_CACHE_URL,
+            '%s/' % cache_prefix)
+
+        # (template name, process function) -> media cache key
+        self.media_source_keys = LRUCache(1000)
+        # (yaml, assets) -> [(source directory, cache directory)]
+        self.asset_directories = LRUCache(1000)
+        # (source directory, cache directory) that we have synced
+        self.synced_assets = LRUCache(1000)
+        # (template name, process function) whose images we have published
+        self.published_references = LRUCache(1000)
+        # rollup key -> (last modified, basename, images embedded in it)
+        self.rollup_basenames = LRUCache(1000)
+
+
 class BasePlan(object):
     """
     Base class that all the plans can subclass.  It provides common things like
@@ -97,10 +240,14 @@ class BasePlan(object):
 
     cache_prefix = 'out'
 
-    __media_source_cache = {}
+    __states = {}
+    __states_lock = threading.Lock()
 
     options = {
         'minify_javascript': True,
+        'fingerprint_static': False,
+        'publish_referenced_images': False,
+        'inline_images_under': 0,
     }
 
     """
@@ -122,14 +269,7 @@ class BasePlan(object):
     make_css_urls_absolute = False
 
     def __init__(self, context, render_full_page):
-        self._prepare_assets_cache = {}
-        setattr(self, '_prepare_assets', memoize(
-            self._prepare_assets, self._prepare_assets_cache, 2))
-
-        self.cache_root = os.path.join(
-            settings.SKYLARK_CACHE_ROOT, self.cache_prefix)
-        self.cache_url = urljoin(settings.SKYLARK_CACHE_URL,
-            '%s/' % self.cache_prefix)
+        self.state = self.get_state()
         self.context = context
         self.render_full_page = render_full_page
 
@@ -147,8 +287,31 @@ class BasePlan(object):
         self.prepared_instructions['render_full_page'] = self.render_full_page
         self.prepared_instructions['cache_prefix'] = '%s/' % self.cache_prefix
 
-        if not os.path.exists(self.cache_root):
-            os.makedirs(self.cache_root)
+    @classmethod
+    def get_state(cls):
+        """
+        The PlanState for this plan class
+        """
+        key = (cls, settings.SKYLARK_CACHE_ROOT, settings.SKYLARK_CACHE_URL)
+        state = BasePlan.__states.get(key)
+        if state is None:
+            BasePlan.__states_lock.acquire()
+            try:
+                state = BasePlan.__states.get(key)
+                if state is None:
+                    state = PlanState(cls.cache_prefix)
+                    BasePlan.__states[key] = state
+            finally:
+                BasePlan.__states_lock.release()
+        return state
+
+    @property
+    def cache_root(self):
+        return self.state.cache_root
+
+    @property
+    def cache_url(self):
+        return self.state.cache_url
 
     @classmethod
     def set_options(*args, **kwargs):
@@ -166,25 +329,15 @@ class BasePlan(object):
         Performs a os.stat on template_name, raising TemplatePathDoesNotExist
         if the template_name is not file based.
         """
-        source, filepath = self._get_source_filepath(template_name)
-        return os.stat(filepath)
+        filepath, st = resolver.stat(template_name)
+        return st
 
     def _get_source_filepath(self, template_name):
         """
         Utilizes some of Django's internals to retrive the source code and
         filepath for a template while bypassing the normal compile behavior
         """
-        # FIXME: we are using the Django file system loader here, this API
-        # might change in the future.  Should we isolate this into a
-        # functional programming style section instead of deep in this
-        # class?
-        try:
-            source, filepath = \
-                filesystem._loader.load_template_source(template_name)
-        except TemplateDoesNotExist:
-            source, filepath = \
-                app_directories._loader.load_template_source(template_name)
-        return source, filepath
+        return resolver.load_source(template_name)
 
     def _get_media_source(self, template_name, process_func=None,
         context=None, no_render=False):
@@ -193,29 +346,48 @@ class BasePlan(object):
 
             * Renders the template with the given context if applicable
             * Passes it through the process function if provided
+
+        The result is kept in the media cache (see skylark.utils.mediacache)
+        keyed by the content of the file, so the process function only runs
+        again when the file changes.  Gives back the source and whether it
+        came from the cache.
         """
-        cache = self.__media_source_cache
+        if context and not no_render:
+            template = loader.get_template(template_name)
+            return template.render(context), False
 
+        cache = mediacache.get_media_cache()
         mem_args = (template_name, process_func)
-        if mem_args in cache and not context and not settings.DEBUG:
-            source = cache[mem_args]
-            is_cached = True
-        else:
-            if context and not no_render:
-                template = loader.get_template(template_name)
-                return template.render(context), False
 
-            source, filepath = self._get_source_filepath(template_name)
+        if not settings.DEBUG:
+            # Files don't change in production, we can go straight to what we
+            # got last time without reading the file
+            key = self.state.media_source_keys.get(mem_args)
+            if key:
+                source = cache.get(key)
+                if source is not None:
+                    return source, True
 
-            if process_func:
-                source = process_func(source)
+        source, filepath = self._get_source_filepath(template_name)
+        key = mediacache.make_key(template_name, process_func, source)
 
-            cache[mem_args] = source
+        processed = cache.get(key)
+        if processed is not None:
+            is_cached = True
+        else:
+            if process_func:
+                processed = process_func(source)
+            else:
+                processed = source
+            if isinstance(processed, basestring):
+                cache.set(key, processed)
             is_cached = False
 
-        return source, is_cached
+        self.state.media_source_keys.set(mem_args, key)
+
+        return processed, is_cached
 
-    def _copy_to_media(self, template_name, source=''):
+    def _copy_to_media(self, template_name, source='', filepath=None):
         """
         Part of our goal here is to make the placement of media a transparent
         deal.  Django does not currently make this easy, you typically have to
@@ -225,18 +397,34 @@ class BasePlan(object):
         example /blog/templates/blog/list/media/css/screen.css and copies it to
         the cache.  It ends up having the same directory structure, so in the
         end gets copied to MEDIA_ROOT/cfcache/blog/media/css/screen.css.
+
+        With the fingerprint_static option the name includes a digest of the
+        source, blog/media/css/screen.0123456789ab.css, so it can be cached
+        forever.
+
+        If source is exactly what is in the file (nothing processed it) pass
+        the filepath along too.  With the hardlink or symlink
+        SKYLARK_PUBLISH_STRATEGY we link to it instead of writing source.
         """
+        if self.options['fingerprint_static']:
+            template_name = fingerprint_name(template_name, source)
+
         dirpath = os.path.join(self.cache_root, os.path.dirname(template_name))
         filename = os.path.basename(template_name)
         fullpath = os.path.join(dirpath, filename)
 
-        if not os.path.isfile(fullpath) or settings.DEBUG:
-            if not os.path.exists(dirpath):
-                os.makedirs(dirpath)
-
-            f = open(fullpath, 'w')
-            f.write(source)
-            f.close()
+        strategy = publish.get_strategy()
+        if filepath and strategy != 'copy':
+            if not publish.is_current(filepath, fullpath, strategy):
+                publish.publish(filepath, fullpath, strategy)
+        elif not os.path.isfile(fullpath) or settings.DEBUG:
+            lock = FileLock(os.path.join(self.cache_root, '.locks',
+                '%s.lock' % content_digest(template_name)))
+            lock.acquire()
+            try:
+                publish.write_file(fullpath, source)
+            finally:
+                lock.release()
 
         return urljoin(self.cache_url, template_name), filename
 
@@ -268,16 +456,29 @@ class BasePlan(object):
 
         To fix this, we need to manipulate the url values and provide a
         corrected URL.
+
+        What we get for a static file is kept in the media cache keyed by the
+        file, the cache url and the source, so a rollup that is built again
+        only fixes the files that changed.
         """
         if 'static' in page_instruction:
             template_name = page_instruction['static']
         elif 'inline' in page_instruction:
-            template_name = page_instruction['inline']
+            # Rendered with the context, not worth keeping
+            return cssimgreplace.relative_replace(css_source,
+                os.path.dirname(page_instruction['inline']), self.cache_url)
 
-        return cssimgreplace.relative_replace(
-            css_source,
-            os.path.dirname(template_name),
-            self.cache_url)
+        cache = mediacache.get_media_cache()
+        key = mediacache.make_key('%s\0%s' % (template_name, self.cache_url),
+            cssimgreplace.relative_replace, css_source)
+
+        fixed = cache.get(key)
+        if fixed is None:
+            fixed = cssimgreplace.relative_replace(css_source,
+                os.path.dirname(template_name), self.cache_url)
+            cache.set(key, fixed)
+
+        return fixed
 
     def _prepare_file(self, item_name, page_instructions):
         """
@@ -326,13 +527,20 @@ class BasePlan(object):
                 source, is_cached = self._get_media_source(
                     template_name, process_func, context)
 
-                if 'css' in item_name and self.make_css_urls_absolute \
-                   and not is_cached:
+                # Only the file itself can be linked into the cache
+                unprocessed = not process_func
+
+                if 'css' in item_name and self.make_css_urls_absolute:
+                    # The media cache has the source before we fix the urls
+                    unprocessed = False
                     source = self._fix_css_urls(instruction, source)
 
                 if 'static' in instruction:
+                    filepath = None
+                    if unprocessed:
+                        filepath = resolver.get_filepath(template_name)
                     location, filename = self._copy_to_media(
-                        template_name, source)
+                        template_name, source, filepath)
                     item['location'] = location
                 elif 'inline' in instruction:
                     item['source'] = source
@@ -379,73 +587,191 @@ class BasePlan(object):
             self._prepare_assets(pi, ('media/js',))
             self._prepare_assets(pi, ('blog/list/media/js',))
 
+        Only the files that have changed since the last time are copied, see
+        skylark.utils.sync.  This gives back a SyncReport for each directory.
         """
         assert type(assets) == tuple or type(assets) == list
 
+        reports = []
+
         for yaml in page_instructions.yaml:
-            # yaml = app/page/page.yaml
-            template, origin = loader.find_template(yaml)
-            filepath = template.origin.name
-
-            # /Users/me/Development/app/templates/app/page/page.yaml
-            yaml_basedir = os.path.dirname(yaml)
-            # app/page
-            template_basedir = filepath[:filepath.find(yaml)]
-            # /Users/me/Development/app/templates
-
-            for asset in assets:
-                # directory = /media/js/templates
-                if not yaml_basedir in asset:
-                    # The user might be specifying the directory relative to
-                    # the yaml file itself, so we'll add it for them if they
-                    # gave us something like 'media/js/templates'
-                    directory = os.path.join(yaml_basedir, asset)
-                else:
+            for sourcedirectory, cachedirectory in \
+                self._find_asset_directories(yaml, assets):
+                report = self._sync_assets(sourcedirectory, cachedirectory)
+                if report:
+                    reports.append(report)
+
+        return reports
+
+    def _find_asset_directories(self, yaml, assets):
+        """
+        Works out where the assets for yaml are and where they go in the
+        cache, giving back a list of (source directory, cache directory)
+
+        Outside of DEBUG we remember this for each process.
+        """
+        key = (self.cache_root, yaml, tuple(assets))
+        directories = self.state.asset_directories.get(key)
+        if directories is not None and not settings.DEBUG:
+            return directories
+
+        directories = []
+
+        # yaml = app/page/page.yaml
+        filepath = resolver.get_filepath(yaml)
+
+        # /Users/me/Development/app/templates/app/page/page.yaml
+        yaml_basedir = os.path.dirname(yaml)
+        # app/page
+        template_basedir = filepath[:filepath.find(yaml)]
+        # /Users/me/Development/app/templates
+
+        for asset in assets:
+            # directory = /media/js/templates
+            if not yaml_basedir in asset:
+                # The user might be specifying the directory relative to the
+                # yaml file itself, so we'll add it for them if they gave us
+                # something like 'media/js/templates'
+                directory = os.path.join(yaml_basedir, asset)
+            else:
+                directory = asset
+
+            sourcedirectory = os.path.join(template_basedir, directory)
+
+            if not os.path.isdir(sourcedirectory):
+                # We're going to try and find it somewhere else, it may not be
+                # relative to the YAML file
+                #
+                # This is quite possible if the yaml file is processing a
+                # "chirp:" attribute.
+                try:
+                    sourcedirectory = find_directory_from_loader(None, asset)
+                    # We need to reset this, it has the yaml_basedir on it at
+                    # this point
                     directory = asset
+                except TemplateDoesNotExist:
+                    continue
+
+            if not os.path.isdir(sourcedirectory):
+                continue
+
+            cachedirectory = os.path.join(self.cache_root, directory)
+
+            directories.append((sourcedirectory, cachedirectory))
 
-                sourcedirectory = os.path.join(template_basedir, directory)
-
-                if not os.path.isdir(sourcedirectory):
-                    # We're going to try and find it somewhere else, it may not
-                    # be relative to the YAML file
-                    #
-                    # This is quite possible if the yaml file is processing a
-                    # "chirp:" attribute.
-                    try:
-                        sourcedirectory = find_directory_from_loader(
-                            page_instructions, asset)
-                        # We need to reset this, it has the yaml_basedir on it
-                        # at this point
-                        directory = asset
-                    except TemplateDoesNotExist:
-                        continue
-
-                if not os.path.isdir(sourcedirectory):
+        self.state.asset_directories.set(key, directories)
+
+        return directories
+
+    def _sync_assets(self, sourcedirectory, cachedirectory):
+        """
+        Brings cachedirectory up to date with sourcedirectory, giving back a
+        SyncReport or None if we already know that nothing has changed.
+
+        With a watcher (see SKYLARK_MEDIA_WATCHER) we only sync when it has
+        seen a change.  Without one we sync on every request while DEBUG is
+        on and once per process when it isn't.
+        """
+        key = (sourcedirectory, cachedirectory)
+        group = ('assets',) + key
+        watcher = get_watcher()
+
+        if key in self.state.synced_assets:
+            if watcher and not watcher.changed(group):
+                return None
+            if not watcher and not settings.DEBUG:
+                return None
+
+        if watcher:
+            # The directories are in here so we hear about new files
+            paths = [sourcedirectory, cachedirectory]
+            for name in sync.scan_directory(sourcedirectory):
+                paths.append(os.path.join(sourcedirectory, name))
+                paths.append(os.path.dirname(paths[-1]))
+            watcher.watch(group, set(paths))
+
+        report = sync.sync_directory(sourcedirectory, cachedirectory)
+        self.state.synced_assets.set(key, True)
+
+        return report
+
+    def _prepare_images(self, page_instructions):
+        """
+        Publishes the images the CSS in page_instructions might use.  That's
+        the media/img directory next to each YAML file, or with the
+        publish_referenced_images option only the files that url() values in
+        the CSS point at.
+        """
+        if self.options['publish_referenced_images']:
+            self._prepare_referenced_images(page_instructions)
+        else:
+            self._prepare_assets(page_instructions, ('media/img',))
+
+    def _prepare_referenced_images(self, page_instructions):
+        """
+        Publishes each file that a relative url() in the CSS of
+        page_instructions points at, wherever it is in the template
+        directories.  Gives back the names of the files that were published.
+
+        Outside of DEBUG we only look at a static file once per process.
+        """
+        published = []
+
+        for instruction in page_instructions.css:
+            template_name = instruction.get('static') or \
+                instruction.get('inline')
+            if not template_name:
+                continue
+
+            process_func = self._get_processing_function(
+                instruction.get('process'))
+            key = (template_name, process_func)
+
+            if 'static' in instruction:
+                if key in self.state.published_references and \
+                   not settings.DEBUG:
                     continue
+                context = None
+            else:
+                context = self.context
 
-                cachedirectory = os.path.join(self.cache_root, directory)
+            source, is_cached = self._get_media_source(
+                template_name, process_func, context)
+            if not isinstance(source, basestring):
+                continue
+
+            for path in cssimgreplace.referenced_paths(source,
+                os.path.dirname(template_name)):
+                if self._publish_referenced_file(path):
+                    published.append(path)
 
-                if os.path.isdir(cachedirectory):
-                    if self._assets_are_stale(sourcedirectory, cachedirectory):
-                        shutil.rmtree(cachedirectory)
-                    else:
-                        continue
+            if 'static' in instruction:
+                self.state.published_references.set(key, True)
 
-                shutil.copytree(sourcedirectory, cachedirectory)
+        return published
 
-    def _assets_are_stale(self, sourcedirectory, cachedirectory):
+    def _publish_referenced_file(self, template_name):
         """
-        Looks through the given directories, determining if they are different
+        Puts the file behind template_name in the same place in the cache,
+        unless it's already there.  Gives back True if it was published.
         """
-        comparison = filecmp.dircmp(sourcedirectory, cachedirectory, [], [])
-        if comparison.left_only or comparison.right_only:
-            # We have files in one directory and not the other
-            return True
-        if comparison.diff_files:
-            # Some of the files have changed
-            return True
+        if template_name.startswith('../') or os.path.isabs(template_name):
+            # Somewhere outside of the template directories
+            return False
 
-        return False
+        try:
+            filepath = resolver.get_filepath(template_name)
+        except TemplateDoesNotExist:
+            # A url that goes nowhere, the browser will find that out for
+            # itself
+            return False
+
+        destination = os.path.join(self.cache_root, template_name)
+        if publish.is_current(filepath, destination):
+            return False
+
+        publish.publish(filepath, destination)
+        return True
 
     def prepare_title(self, page_instructions):
         """
@@ -506,6 +832,48 @@ class BasePlan(object):
             """
             self._prepare_assets(page_instructions, (location,))
 
+    def prepare_media(self, page_instructions):
+        """
+        Prepares the js, css, and chirp sections.  This is where all the work
+        of copying, processing, and rolling up the media happens.
+        """
+        self.page_instructions = page_instructions
+
+        self.prepare_js(page_instructions)
+        self.prepare_css(page_instructions)
+        self.prepare_chirp(page_instructions)
+
+    def prepare_media_from_manifest(self, page_instructions):
+        """
+        Uses the media that skylark_build prepared ahead of time for these page
+        instructions.  Returns False if the manifest doesn't know about them.
+        """
+        entry = build.get_manifest_entry(self, page_instructions)
+
+        if entry is None:
+            return False
+
+        for attr in ('js', 'css', 'chirp',):
+            prepared = copy.deepcopy(entry[attr])
+            for item in prepared:
+                if 'inline' in item:
+                    # Inline media depends on the context, it's the one thing
+                    # we have to do on every request
+                    self._prepare_inline(attr, item)
+            self.prepared_instructions[attr] = prepared
+
+        return True
+
+    def _prepare_inline(self, item_name, item):
+        process_func = self._get_processing_function(item.get('process'))
+        source, is_cached = self._get_media_source(
+            item['inline'], process_func, self.context)
+
+        if 'css' in item_name and self.make_css_urls_absolute:
+            source = self._fix_css_urls(item, source)
+
+        item['source'] = source
+
     def prepare(self, page_instructions, omit_media=False):
         self.page_instructions = page_instructions
 
@@ -525,22 +893,29 @@ class BasePlan(object):
             out the media sections of our prepared instructions here to prevent
             duplication.
             """
-            self.prepare_js(page_instructions)
-            self.prepare_css(page_instructions)
-            self.prepare_chirp(page_instructions)
+            if not settings.SKYLARK_USE_BUILD_MANIFEST or \
+               not self.prepare_media_from_manifest(page_instructions):
+                self.prepare_media(page_instructions)
 
         return self.prepared_instructions
 
 
 class RollupPlan(object):
-    __rollup_last_modifieds = {}
-
     """
     These are extra methods that are needed for rolling up files
 
     A rollup is when you take multiple files and concatenate them into one.
     """
-    def _concat_files(self, instructions, fix_css_urls=False):
+    def _concat_files(self, instructions, fix_css_urls=False, minifier=None,
+                      images=None):
+        """
+        Puts the files of a rollup together.  The template names of the images
+        we looked at for the inline_images_under option are added to images,
+        if it's a list.
+        """
+        def get_data_uri(template_name):
+            return self._get_data_uri(template_name, images)
+
         source = []
         for i in instructions:
             processed = ''
@@ -552,16 +927,88 @@ class RollupPlan(object):
                     i['static'], process_func, no_render=True)
             if fix_css_urls:
                 processed = self._fix_css_urls(i, processed)
+                if self.options['inline_images_under']:
+                    processed = cssimgreplace.inline_replace(processed,
+                        self.cache_url, get_data_uri)
             if isinstance(processed, basestring):
+                if minifier:
+                    processed = self._get_minified_source(i['static'],
+                        processed, minifier)
                 source.append(processed)
             else:
                 source.extend(processed)
         return "\n".join(source)
 
-    def _make_filename(self, files):
+    def _get_minified_source(self, template_name, source, minifier):
+        """
+        Minifies one file of a rollup.  The result is kept in the media cache
+        keyed by the source, so when one file of a rollup changes only that
+        file is minified again.
+        """
+        cache = mediacache.get_media_cache()
+        key = mediacache.make_key(template_name, minifier, source)
+
+        minified = cache.get(key)
+        if minified is None:
+            minified = minifier(source)
+            cache.set(key, minified)
+
+        return minified
+
+    def _get_data_uri(self, template_name, images=None):
+        """
+        The file behind template_name as a data: URI, or None if it's not an
+        image or it isn't smaller than the inline_images_under option.  Every
+        image we find is added to images, if it's a list, whether it was small
+        enough or not.  Changing any of them changes the rollup.
+
+        The encoded image is kept in the media cache keyed by a digest of the
+        file, so we only encode it again when it changes.
+        """
+        template_name = template_name.split('#', 1)[0].split('?', 1)[0]
+        if template_name.startswith('../') or os.path.isabs(template_name):
+            return None
+
+        mimetype = mimetypes.guess_type(template_name)[0]
+        if not mimetype or not mimetype.startswith('image/'):
+            return None
+
+        try:
+            filepath, st = resolver.stat(template_name)
+        except (TemplateDoesNotExist, OSError):
+            return None
+
+        if images is not None and template_name not in images:
+            images.append(template_name)
+
+        if st.st_size >= self.options['inline_images_under']:
+            return None
+
+        f = open(filepath, 'rb')
+        try:
+            source = f.read()
+        finally:
+            f.close()
+
+        cache = mediacache.get_media_cache()
+        key = mediacache.make_key(mimetype, encode_data_uri, source)
+
+        uri = cache.get(key)
+        if uri is None:
+            uri = encode_data_uri(source, mimetype)
+            cache.set(key, uri)
+
+        return uri
+
+    def _make_filename(self, files, *variables):
+        """
+        Identifies a rollup by the files that go in it and anything else that
+        changes what we build out of them.  The name of the file we write
+        comes from its content, see _rollup_static_files
+        """
         files.sort()
         return hashlib.md5('%s%s' % (settings.SKYLARK_PLANS_ROLLUP_SALT,
-            pickle.dumps(files))).hexdigest()
+            pickle.dumps((files,) + variables))).hexdigest()
 
     def _prepare_rollup(self, attr, rollup, keep, insert_point, **kwargs):
         if not keep and not rollup:
@@ -596,7 +1043,8 @@ class RollupPlan(object):
         wrap_source=None):
         """
         Creates one file from a list of others.  It also minifies the source
-        using the appropriate function
+        using the appropriate function, one file at a time so the minified
+        files can be cached
 
         wrap_source is a tuple with a length of 2.  It can be used to prepend
         and append content to the rolled up file.  For example the following
@@ -607,54 +1055,177 @@ class RollupPlan(object):
         fix_css_urls = True if 'css' in extension else False
         is_lessjs = self._instructions_have_lessjs(instructions)
 
-        def nop_minifier(arg):
-            """
-            A minifier that does nothing, but is callable
-            """
-            return arg
-
-        # Figure out a name
         files = [i['static'] for i in instructions]
 
-        basename = '%s.%s' % (self._make_filename(files), extension,)
-        filename = os.path.join(self.cache_root, basename)
-        location = urljoin(self.cache_url, basename)
-        retval = {'location': location}
+        if not files:
+            return None
+
+        retval = {}
 
         if is_lessjs:
             retval['process'] = 'lessjs'
 
-        if not files:
-            return None
+        if minifier and not is_lessjs:
+            minifier_name = '%s.%s' % (minifier.__module__, minifier.__name__)
+        else:
+            minifier_name = None
+
+        # Everything besides the files themselves that changes what we would
+        # build, a rollup built some other way is a different rollup
+        name = self._make_filename(files,
+            sorted([(i['static'], i.get('process')) for i in instructions]),
+            extension, minifier_name, wrap_source, self.cache_url,
+            fix_css_urls and self.options['inline_images_under'],
+            get_rollup_code_digest())
+        rollup_key = (name, extension)
+        watcher = get_watcher()
+
+        rollup_basenames = self.state.rollup_basenames
+        last_built = rollup_basenames.get(rollup_key)
+
+        if watcher and last_built and not watcher.changed(rollup_key):
+            # The watcher would have told us if any of the files changed, so
+            # we don't need to look at them
+            last_seen, basename, images = last_built
+            retval['location'] = urljoin(self.cache_url, basename)
+            return retval
+
+        if watcher:
+            # Start watching before we read anything so we don't miss changes
+            # made while we are building
+            watcher.watch(rollup_key,
+                [resolver.get_filepath(i) for i in files])
 
         lastmod = max([self._get_media_stat(i).st_mtime for i in files])
 
-        if os.path.isfile(filename) and \
-           filename in self.__rollup_last_modifieds and \
-           self.__rollup_last_modifieds[filename] == lastmod:
-            # Nothing has changed since we last saw this instruction set
-            return retval
-        self.__rollup_last_modifieds[filename] = lastmod
+        if last_built:
+            last_seen, basename, images = last_built
+            filename = os.path.join(self.cache_root, basename)
+            if last_seen == self._get_images_lastmod(lastmod, images) and \
+               os.path.isfile(filename):
+                # Nothing has changed since we last saw this instruction set
+                if watcher:
+                    watcher.extend(rollup_key,
+                        [filename] + self._get_image_filepaths(images))
+                retval['location'] = urljoin(self.cache_url, basename)
+                return retval
+
+        record = os.path.join(self.cache_root, '.rollups',
+            '%s.%s' % rollup_key)
+        lock = FileLock('%s.lock' % record)
+
+        if not lock.acquire(blocking=False):
+            # Another worker is building this rollup
+            if last_built:
+                last_seen, basename, images = last_built
+                if os.path.isfile(os.path.join(self.cache_root, basename)):
+                    # The one we had will do until they are done, but we
+                    # need to look again next time
+                    if watcher:
+                        watcher.unwatch(rollup_key)
+                    retval['location'] = urljoin(self.cache_url, basename)
+                    return retval
+            lock.acquire()
 
-        if not wrap_source:
-            wrap_source = ('', '',)
+        try:
+            basename, images = self._read_rollup_record(record, lastmod)
+
+            if not basename:
+                if not wrap_source:
+                    wrap_source = ('', '',)
+
+                if is_lessjs:
+                    """
+                    If lessjs is used, we can't alter the original file
+                    because it will throw the parser off.  So we turn off the
+                    minification
+                    """
+                    minifier = None
+
+                images = []
+                source = self._concat_files(instructions, fix_css_urls,
+                    minifier, images)
+                source = '%s\n%s\n%s' % (
+                    wrap_source[0], source, wrap_source[1],)
+
+                # The name comes from the content, so the same rollup has the
+                # same url on every server and we never have to change a file
+                # once it's written
+                basename = '%s.%s' % (content_digest(source), extension,)
+
+                if not os.path.isfile(
+                   os.path.join(self.cache_root, basename)):
+                    publish.write_file(
+                        os.path.join(self.cache_root, basename), source)
+
+                publish.write_file(record, '\n'.join(['%r %s' % (
+                    self._get_images_lastmod(lastmod, images), basename)] +
+                    images))
+        finally:
+            lock.release()
+
+        # The images count towards when the rollup was last modified
+        rollup_basenames.set(rollup_key,
+            (self._get_images_lastmod(lastmod, images), basename, images))
+
+        if watcher:
+            # Somebody cleaning out the cache counts as a change too, and so
+            # does changing one of the images embedded in it
+            watcher.extend(rollup_key,
+                [os.path.join(self.cache_root, basename)] +
+                self._get_image_filepaths(images))
+
+        retval['location'] = urljoin(self.cache_url, basename)
+        return retval
 
-        if not minifier or is_lessjs:
-            """
-            If minifier is not defined we use a no-operate version
+    def _read_rollup_record(self, record, lastmod):
+        """
+        Each rollup has a record of the last version built, by any process,
+        and the images that were embedded in it.  Gives back its name and the
+        images if it was built from files modified at lastmod, none of the
+        images have changed since, and it is still there.  Otherwise the name
+        is None.
+        """
+        try:
+            f = open(record)
+            try:
+                lines = f.read().split('\n')
+            finally:
+                f.close()
+            last_seen, basename = lines[0].split()
+            last_seen = float(last_seen)
+        except (IOError, ValueError):
+            return None, []
 
-            If lessjs is used, we can't alter the original file because it will
-            throw the parser off.  So we turn off the minification
-            """
-            minifier = nop_minifier
+        images = [i for i in lines[1:] if i]
 
-        if not os.path.isfile(filename) or settings.DEBUG:
-            f = open(filename, 'w')
-            source = minifier(self._concat_files(instructions, fix_css_urls))
-            f.write('%s\n%s\n%s' % (wrap_source[0], source, wrap_source[1],))
-            f.close()
+        if last_seen != self._get_images_lastmod(lastmod, images) or \
+           not os.path.isfile(os.path.join(self.cache_root, basename)):
+            return None, []
 
-        return retval
+        return basename, images
+
+    def _get_images_lastmod(self, lastmod, images):
+        """
+        lastmod, or the modified time of one of images if that's later.  None
+        if one of them is gone.
+        """
+        for image in images:
+            try:
+                filepath, st = resolver.stat(image)
+            except (TemplateDoesNotExist, OSError):
+                return None
+            lastmod = max(lastmod, st.st_mtime)
+        return lastmod
+
+    def _get_image_filepaths(self, images):
+        filepaths = []
+        for image in images:
+            try:
+                filepaths.append(resolver.get_filepath(image))
+            except TemplateDoesNotExist:
+                pass
+        return filepaths
 
     def __dojo_register_module_path(self, namespace, basename):
         location = urljoin(self.cache_url, basename)
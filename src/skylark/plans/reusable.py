@@ -45,7 +45,7 @@ class ReusableFiles(BasePlan, RollupPlan):
         if not hasattr(page_instructions, 'css'):
             return
 
-        self._prepare_assets(page_instructions, ('media/img',))
+        self._prepare_images(page_instructions)
 
         rollup, keep, insert_point = self.__split_static_uses(
             'css', page_instructions)
@@ -14,6 +14,6 @@ class SeparateEverything(BasePlan):
         if not hasattr(page_instructions, 'css'):
             return
 
-        self._prepare_assets(page_instructions, ('media/img',))
+        self._prepare_images(page_instructions)
 
         self._prepare_file('css', page_instructions)
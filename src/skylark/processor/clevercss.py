@@ -223,11 +223,23 @@
 import re
 import colorsys
 import operator
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 VERSION = '0.1'
 
-__all__ = ['convert']
+#: bumped whenever the parsed structure changes so old dumps aren't loaded
+DUMP_VERSION = 2
+
+__all__ = ['convert', 'adjust_colors', 'brighten_colors', 'darken_colors',
+           'saturate_colors', 'shift_colors', 'calc_colors']
 
 
 # regular expresssions for the normal parser
@@ -431,6 +443,86 @@ _var_re = re.compile(r'(?<!\\)\$(?:([a-zA-Z_][a-zA-Z0-9_]*)|'
 _call_re = re.compile(r'\.' + _r_call)
 
 
+def _process(token, group=0):
+    return lambda m, base, lineno: (m.group(base + group), token)
+
+
+def _process_string(m, base, lineno):
+    value = m.group(base)
+    try:
+        if value[:1] == value[-1:] and value[0] in '"\'':
+            value = value[1:-1].encode('utf-8') \
+                               .decode('string-escape') \
+                               .encode('utf-8')
+        elif value == 'rgb':
+            return None, 'rgb'
+        elif value in _colors:
+            return value, 'color'
+    except UnicodeError:
+        raise ParserError(lineno, 'invalid string escape')
+    return value, 'string'
+
+
+# the rules of the expression tokenizer, the first one that matches wins.
+# the processors get the match, the number of the group the rule starts at
+# and the line number.
+_token_rules = ((_webkit_re, _process('webkit', 1)),
+                (_operator_re, _process('op')),
+                (_call_re, _process('call', 1)),
+                (_value_re, lambda m, base, lineno: ((m.group(base + 1),
+                    m.group(base + 2)), 'value')),
+                (_color_re, _process('color')),
+                (_number_re, _process('number')),
+                (_rgba_re, _process('rgba', 1)),
+                (_url_re, _process('url', 1)),
+                (_string_re, _process_string),
+                (_var_re, lambda m, base, lineno: (m.group(base + 1) or
+                    m.group(base + 2), 'var')),
+                (_whitespace_re, None))
+
+
+def _make_token_re(rules):
+    """
+    Join the rules into one regular expression.  Alternatives are tried in
+    order just like the rules, and the group that matched tells us which
+    processor to use.
+    """
+    patterns = []
+    processors = {}
+    group = 1
+    for rule, processor in rules:
+        patterns.append('(%s)' % rule.pattern)
+        processors[group] = (processor, group)
+        group += rule.groups + 1
+    return re.compile('|'.join(patterns)), processors
+
+_token_re, _token_processors = _make_token_re(_token_rules)
+
+
+def tokenize(lineno, s):
+    """
+    Split the expression `s` into tokens.  Gives back the tokens and the
+    error that stopped us, or `None` if we got to the end.  The error is
+    raised once the parser gets to it.
+    """
+    tokens = []
+    pos = 0
+    end = len(s)
+    match = _token_re.match
+    try:
+        while pos < end:
+            m = match(s, pos)
+            if m is None:
+                raise ParserError(lineno, 'Syntax error')
+            processor, base = _token_processors[m.lastindex]
+            if processor is not None:
+                tokens.append(processor(m, base, lineno))
+            pos = m.end()
+    except (ParserError, ValueError), e:
+        return tokens, e
+    return tokens, None
+
+
 def number_repr(value):
     """
     CleverCSS uses floats internally.  To keep the string representation
@@ -458,6 +550,190 @@ def hls_to_rgb(hue, saturation, lightness):
     return tuple(int(x * 255) for x in t)
 
 
+# batches of colors smaller than this are done in pure Python even if NumPy is
+# available, for a handful of colors setting up the arrays costs more than it
+# saves.  Both ways do the same floating point operations in the same order as
+# colorsys, so the results are identical either way.
+NUMPY_THRESHOLD = 16
+
+_hls_index = {'hue': 0, 'lightness': 1, 'saturation': 2}
+
+
+def _adjust_colors_python(colors, index, amount, relative):
+    adjusted = []
+    for color in colors:
+        hls = list(rgb_to_hls(*color))
+        if relative:
+            hls[index] *= amount / 100.0
+        else:
+            hls[index] += amount / 100.0
+        if index == 0:
+            while hls[0] < 0 or hls[0] > 1.0:
+                if hls[0] < 0:
+                    hls[0] += 1.0
+                else:
+                    hls[0] -= 1.0
+        elif hls[index] < 0:
+            hls[index] = 0.0
+        elif hls[index] > 1:
+            hls[index] = 1.0
+        adjusted.append(hls_to_rgb(*hls))
+    return adjusted
+
+
+def _numpy_v(m1, m2, hue):
+    hue = hue % 1.0
+    return numpy.where(hue < colorsys.ONE_SIXTH, m1 + (m2 - m1) * hue * 6.0,
+           numpy.where(hue < 0.5, m2,
+           numpy.where(hue < colorsys.TWO_THIRD,
+                       m1 + (m2 - m1) * (colorsys.TWO_THIRD - hue) * 6.0,
+                       m1)))
+
+
+def _adjust_colors_numpy(colors, index, amount, relative):
+    rgb = numpy.asarray(colors, dtype=float).reshape(-1, 3) / 255.0
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+
+    # colorsys.rgb_to_hls for all of them at once
+    maxc = numpy.maximum(numpy.maximum(r, g), b)
+    minc = numpy.minimum(numpy.minimum(r, g), b)
+    grey = minc == maxc
+    old_settings = numpy.seterr(divide='ignore', invalid='ignore')
+    try:
+        l = (minc + maxc) / 2.0
+        s = numpy.where(l <= 0.5, (maxc - minc) / (maxc + minc),
+                        (maxc - minc) / (2.0 - maxc - minc))
+        rc = (maxc - r) / (maxc - minc)
+        gc = (maxc - g) / (maxc - minc)
+        bc = (maxc - b) / (maxc - minc)
+        h = numpy.where(r == maxc, bc - gc,
+            numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = (h / 6.0) % 1.0
+    finally:
+        numpy.seterr(**old_settings)
+    h[grey] = 0.0
+    s[grey] = 0.0
+
+    hls = [h, l, s]
+    if relative:
+        hls[index] = hls[index] * (amount / 100.0)
+    else:
+        hls[index] = hls[index] + amount / 100.0
+    if index == 0:
+        h = hls[0]
+        while True:
+            low = h < 0
+            high = h > 1.0
+            if not (low.any() or high.any()):
+                break
+            h[low] += 1.0
+            h[high] -= 1.0
+    else:
+        value = hls[index]
+        hls[index] = numpy.where(value < 0, 0.0,
+                                 numpy.where(value > 1, 1.0, value))
+    h, l, s = hls
+
+    # and colorsys.hls_to_rgb
+    m2 = numpy.where(l <= 0.5, l * (1.0 + s), l + s - (l * s))
+    m1 = 2.0 * l - m2
+    channels = [numpy.where(s == 0.0, l, _numpy_v(m1, m2, hue)) for hue in
+                (h + colorsys.ONE_THIRD, h, h - colorsys.ONE_THIRD)]
+
+    rgb = (numpy.column_stack(channels) * 255).astype(int)
+    return [tuple(color) for color in rgb.tolist()]
+
+
+def adjust_colors(colors, attribute, amount=10.0, relative=True):
+    """
+    Change the `attribute` (``'hue'``, ``'lightness'`` or ``'saturation'``)
+    of many colors at once.  `colors` is a sequence of ``(red, green, blue)``
+    tuples with values from 0 to 255 (or a NumPy array of them), and a list
+    of tuples is given back.
+
+    If `relative` is true the attribute is multiplied by `amount` percent,
+    like ``$color.brighten(10%)``, otherwise `amount` is added to it on a
+    scale of 0 to 100, like ``$color.brighten(10)``.
+
+    NumPy is used if it is installed and there are enough colors to make it
+    worth it.
+    """
+    index = _hls_index[attribute]
+    if numpy is None or not isinstance(colors, numpy.ndarray):
+        colors = list(colors)
+    if relative and not amount:
+        return [tuple(color) for color in colors]
+    if numpy is not None and len(colors) >= NUMPY_THRESHOLD:
+        return _adjust_colors_numpy(colors, index, amount, relative)
+    return _adjust_colors_python(colors, index, amount, relative)
+
+
+def brighten_colors(colors, amount=10.0, relative=True):
+    """`adjust_colors` for the lightness."""
+    return adjust_colors(colors, 'lightness', amount, relative)
+
+
+def darken_colors(colors, amount=10.0, relative=True):
+    """
+    `adjust_colors` for the lightness, an absolute `amount` is taken off.
+    """
+    if not relative:
+        amount = -amount
+    return adjust_colors(colors, 'lightness', amount, relative)
+
+
+def saturate_colors(colors, amount=10.0, relative=True):
+    """`adjust_colors` for the saturation."""
+    return adjust_colors(colors, 'saturation', amount, relative)
+
+
+def shift_colors(colors, amount=10.0, relative=True):
+    """`adjust_colors` for the hue."""
+    return adjust_colors(colors, 'hue', amount, relative)
+
+
+def calc_colors(colors, other, method):
+    """
+    Combine each of `colors` with `other`, a color or a number, a channel at
+    a time using `method` (for example `operator.add`).  The channels are
+    kept between 0 and 255.  Dividing by zero raises ZeroDivisionError
+    whether NumPy is used or not.
+    """
+    if numpy is None or not isinstance(colors, numpy.ndarray):
+        colors = list(colors)
+    if numpy is not None and len(colors) >= NUMPY_THRESHOLD:
+        # NumPy would give back 0 with a warning, Python raises
+        old_settings = numpy.seterr(divide='raise')
+        try:
+            try:
+                channels = method(
+                    numpy.asarray(colors, dtype=int).reshape(-1, 3),
+                    numpy.asarray(other, dtype=int))
+            except FloatingPointError:
+                raise ZeroDivisionError('integer division or modulo by zero')
+        finally:
+            numpy.seterr(**old_settings)
+        channels = numpy.clip(channels, 0, 255)
+        return [tuple(color) for color in channels.tolist()]
+
+    calculated = []
+    for color in colors:
+        channels = []
+        for idx, val in enumerate(color):
+            if isinstance(other, (int, long)):
+                other_val = other
+            else:
+                other_val = other[idx]
+            new_val = method(val, other_val)
+            if new_val > 255:
+                new_val = 255
+            elif new_val < 0:
+                new_val = 0
+            channels.append(new_val)
+        calculated.append(tuple(channels))
+    return calculated
+
+
 class ParserError(Exception):
     """
     Raised on syntax errors.
@@ -513,12 +789,18 @@ class LineIterator(object):
 
     def __init__(self, source, emit_endmarker=False):
         """
+        `source` is a string or anything that yields lines, like a file.  A
+        file is read a line at a time instead of all at once, open it with
+        universal newlines (and decode it, `io.open` does both).
+
         If `emit_endmarkers` is set to `True` the line iterator will send
         the string ``'__END__'`` before closing down.
         """
-        lines = source.splitlines()
+        if isinstance(source, basestring):
+            lines = source.splitlines()
+        else:
+            lines = (line.rstrip('\r\n') for line in source)
         self.lineno = 0
-        self.lines = len(lines)
         self.emit_endmarker = emit_endmarker
         self._lineiter = iter(lines)
 
@@ -581,9 +863,36 @@ class Engine(object):
     nobody uses this because the `convert` function wraps it.
     """
 
-    def __init__(self, source):
+    def __init__(self, source=None, parsed=None):
+        """
+        `source` is a string or a file (see `LineIterator`).  `parsed` is
+        what `Parser.parse` gives back, if you have it there is no need for
+        the source.
+        """
         self._parser = p = Parser()
-        self.rules, self._vars = p.parse(source)
+        if parsed is None:
+            parsed = p.parse(source)
+        self.rules, self._vars = parsed
+
+    def dumps(self):
+        """
+        Serialise the parsed rules and variables.  `Engine.loads` turns the
+        result back into an engine without parsing the source again.
+        """
+        return pickle.dumps((DUMP_VERSION, self.rules, self._vars),
+                            pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Create an engine from the result of `dumps`.  Raises `ValueError`
+        if it was dumped by a different version.
+        """
+        version, rules, vars = pickle.loads(data)
+        if version != DUMP_VERSION:
+            raise ValueError('dumped by version %r of the parser, this is '
+                             'version %r' % (version, DUMP_VERSION))
+        return cls(parsed=(rules, vars))
 
     def evaluate(self, context=None):
         """Evaluate code."""
@@ -598,33 +907,55 @@ class Engine(object):
             yield selectors, [(key, expr.to_string(context))
                               for key, expr in defs]
 
-    def to_css(self, context=None):
-        """Evaluate the code and generate a CSS file."""
-        blocks = []
+    def iter_css(self, context=None):
+        """
+        Evaluate the code and yield the CSS a rule at a time, so the whole
+        stylesheet never has to be in memory at once.
+        """
+        separator = u''
         for selectors, defs in self.evaluate(context):
-            block = []
-            block.append(u',\n'.join(selectors) + ' {')
+            block = [separator + u',\n'.join(selectors) + ' {']
             for key, value in defs:
                 block.append(u'  %s: %s;' % (key, value))
             block.append('}')
-            blocks.append(u'\n'.join(block))
-        return u'\n\n'.join(blocks)
+            yield u'\n'.join(block)
+            separator = u'\n\n'
+
+    def write_css(self, stream, context=None, encoding=None):
+        """
+        Evaluate the code and write the CSS to the file-like `stream` as it
+        is generated.  If `encoding` is given the CSS is encoded first.
+        """
+        for chunk in self.iter_css(context):
+            if encoding is not None:
+                chunk = chunk.encode(encoding)
+            stream.write(chunk)
+
+    def to_css(self, context=None):
+        """Evaluate the code and generate a CSS file."""
+        return u''.join(self.iter_css(context))
 
 
 class TokenStream(object):
     """
-    This is used by the expression parser to manage the tokens.
+    This is used by the expression parser to manage the tokens.  `error` is
+    raised when the parser reads past the last token.
     """
 
-    def __init__(self, lineno, gen):
+    def __init__(self, lineno, tokens, error=None):
         self.lineno = lineno
-        self.gen = gen
+        self.tokens = tokens
+        self.error = error
+        self.pos = 0
         self.next()
 
     def next(self):
-        try:
-            self.current = self.gen.next()
-        except StopIteration:
+        if self.pos < len(self.tokens):
+            self.current = self.tokens[self.pos]
+            self.pos += 1
+        elif self.error is not None:
+            raise self.error
+        else:
             self.current = None, 'eof'
 
     def expect(self, value, token):
@@ -940,42 +1271,35 @@ class Value(Literal):
         return number_repr(self.value) + self.unit
 
 def adjust_color(color, amount=None, attribute=None):
+    """
+    The single color version of `adjust_colors`, which this goes through so
+    stylesheets and batches give the same results.
+    """
     if amount is None:
         amount = Value(10.0, '%')
-    hls = {}
-    hls['hue'], hls['lightness'], hls['saturation'] = rgb_to_hls(*color.value)
     if isinstance(amount, Value):
-        if amount.unit == '%':
-            if not amount.value:
-                return color
-            hls[attribute] *= amount.value / 100.0
-        else:
-            raise EvalException(self.lineno, 'invalid unit %s for color '
+        if amount.unit != '%':
+            raise EvalException(color.lineno, 'invalid unit %s for color '
                                 'calculations.' % amount.unit)
+        if not amount.value:
+            return color
+        value, relative = amount.value, True
     elif isinstance(amount, Number):
-        hls[attribute] += (amount.value / 100.0)
-    
-    if attribute == 'hue':
-        while hls[attribute] < 0 or hls[attribute] > 1.0:
-            if hls[attribute] < 0:
-                hls[attribute] += 1.0
-            elif hls[attribute] > 0:
-                hls[attribute] -= 1.0
+        value, relative = amount.value, False
     else:
-        if hls[attribute] < 0:
-            hls[attribute] = 0.0
-        elif hls[attribute] > 1:
-            hls[attribute] = 1.0
+        value, relative = 0.0, False
 
-    return Color(hls_to_rgb(hls['hue'], hls['lightness'], hls['saturation']))
+    return Color(adjust_colors([color.value], attribute, value, relative)[0])
 
 def brighten_color(color, context, amount=None):
     return adjust_color(color, amount, 'lightness')
 
 def darken_color(color, context, amount=None):
-    # Since we are darkening, this is a sign flip on the value
+    # Since we are darkening, this is a sign flip on the value.  The amount
+    # may be part of the parsed expression or a variable's value, so don't
+    # change it in place.
     if isinstance(amount, Number):
-        amount.value *= -1
+        amount = Number(-amount.value, lineno=amount.lineno)
 
     return adjust_color(color, amount, 'lightness')
 
@@ -1040,20 +1364,12 @@ class Color(Literal):
         return self.from_name and _reverse_colors.get(code) or code
 
     def _calc(self, other, method):
-        is_number = isinstance(other, Number)
-        channels = []
-        for idx, val in enumerate(self.value):
-            if is_number:
-                other_val = int(other.value)
-            else:
-                other_val = other.value[idx]
-            new_val = method(val, other_val)
-            if new_val > 255:
-                new_val = 255
-            elif new_val < 0:
-                new_val = 0
-            channels.append(new_val)
-        return Color(tuple(channels), lineno=self.lineno)
+        if isinstance(other, Number):
+            other_value = int(other.value)
+        else:
+            other_value = other.value
+        return Color(calc_colors([self.value], other_value, method)[0],
+                     lineno=self.lineno)
 
 
 class RGB(Expr):
@@ -1146,9 +1462,12 @@ class Var(Expr):
         val = context[self.name]
         context[self.name] = FailingVar(self, self.lineno)
         try:
-            return val.evaluate(context)
+            val = val.evaluate(context)
         finally:
+            # the context belongs to this conversion, so the next time the
+            # variable is used it doesn't have to be evaluated again
             context[self.name] = val
+        return val
 
 
 class FailingVar(Expr):
@@ -1184,6 +1503,55 @@ class List(Expr):
         return u', '.join(x.to_string(context) for x in self.items)
 
 
+def fold_constants(node):
+    """
+    Evaluate the parts of an expression that don't depend on variables, so
+    that only has to happen once and not every time the stylesheet is
+    evaluated.  Gives back the new node and whether it is constant.
+
+    Anything that fails to evaluate is left alone so the error comes up at
+    the same time it always did.
+    """
+    if isinstance(node, Literal):
+        return node, True
+    elif isinstance(node, Bin):
+        node.left, left = fold_constants(node.left)
+        node.right, right = fold_constants(node.right)
+        constant = left and right
+    elif isinstance(node, Neg):
+        node.node, constant = fold_constants(node.node)
+    elif isinstance(node, Call):
+        node.node, constant = fold_constants(node.node)
+        for idx, arg in enumerate(node.args):
+            node.args[idx], arg_constant = fold_constants(arg)
+            constant = constant and arg_constant
+    elif isinstance(node, RGB):
+        rgb = []
+        constant = True
+        for arg in node.rgb:
+            arg, arg_constant = fold_constants(arg)
+            rgb.append(arg)
+            constant = constant and arg_constant
+        node.rgb = tuple(rgb)
+    elif isinstance(node, (ImplicitConcat, List)):
+        # these are never evaluated as a whole, only the items are
+        items = isinstance(node, List) and node.items or node.nodes
+        constant = True
+        for idx, item in enumerate(items):
+            items[idx], item_constant = fold_constants(item)
+            constant = constant and item_constant
+        return node, constant
+    else:
+        return node, False
+
+    if constant:
+        try:
+            return node.evaluate({}), True
+        except Exception:
+            pass
+    return node, False
+
+
 class Parser(object):
     """
     Class with a bunch of methods that implement a tokenizer and parser.  In
@@ -1377,53 +1745,11 @@ class Parser(object):
         return result, real_vars
 
     def parse_expr(self, lineno, s):
-        def parse():
-            pos = 0
-            end = len(s)
-
-            def process(token, group=0):
-                return lambda m: (m.group(group), token)
-
-            def process_string(m):
-                value = m.group(0)
-                try:
-                    if value[:1] == value[-1:] and value[0] in '"\'':
-                        value = value[1:-1].encode('utf-8') \
-                                           .decode('string-escape') \
-                                           .encode('utf-8')
-                    elif value == 'rgb':
-                        return None, 'rgb'
-                    elif value in _colors:
-                        return value, 'color'
-                except UnicodeError:
-                    raise ParserError(lineno, 'invalid string escape')
-                return value, 'string'
-
-            rules = ((_webkit_re, process('webkit', 1)),
-                     (_operator_re, process('op')),
-                     (_call_re, process('call', 1)),
-                     (_value_re, lambda m: (m.groups(), 'value')),
-                     (_color_re, process('color')),
-                     (_number_re, process('number')),
-                     (_rgba_re, process('rgba', 1)),
-                     (_url_re, process('url', 1)),
-                     (_string_re, process_string),
-                     (_var_re, lambda m: (m.group(1) or m.group(2), 'var')),
-                     (_whitespace_re, None))
-
-            while pos < end:
-                for rule, processor in rules:
-                    m = rule.match(s, pos)
-                    if m is not None:
-                        if processor is not None:
-                            yield processor(m)
-                        pos = m.end()
-                        break
-                else:
-                    raise ParserError(lineno, 'Syntax error')
-
         s = s.rstrip(';')
-        return self.expr(TokenStream(lineno, parse()))
+        tokens, error = tokenize(lineno, s)
+        node, constant = fold_constants(
+            self.expr(TokenStream(lineno, tokens, error)))
+        return node
 
     def expr(self, stream, ignore_comma=False):
         args = [self.concat(stream)]
@@ -1615,28 +1941,36 @@ def main():
             sys.stderr.write('Error: %s\n' % e)
             sys.exit(1)
 
-    # convert some files
+    # convert some files, a line and a rule at a time
     else:
+        import io
+        import os
         for fn in sys.argv[1:]:
-            target = fn.rsplit('.', 1)[-1] + '.css'
+            target = fn.rsplit('.', 1)[0] + '.css'
             if fn == target:
                 sys.stderr.write('Error: same name for source and target file'
                                  ' "%s".' % fn)
                 sys.exit(2)
-            src = file(fn)
+            src = io.open(fn, encoding='utf-8')
             try:
                 try:
-                    converted = convert(src.read())
+                    engine = Engine(src)
                 except (ParserError, EvalException), e:
                     sys.stderr.write('Error in file %s: %s\n' % (fn, e))
                     sys.exit(1)
-                dst = file(target, 'w')
+            finally:
+                src.close()
+            dst = io.open(target, 'w', encoding='utf-8')
+            try:
                 try:
-                    dst.write(converted)
-                finally:
+                    engine.write_css(dst)
+                except (ParserError, EvalException), e:
                     dst.close()
+                    os.remove(target)
+                    sys.stderr.write('Error in file %s: %s\n' % (fn, e))
+                    sys.exit(1)
             finally:
-                src.close()
+                dst.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+"""
+Finds the files that sit behind template names.
+
+Django Skylark treats a lot of things as templates (YAML files, CSS,
+Javascript) even though most of the time we only need to know where the file
+is or what is inside of it without compiling it.
+
+The first time we are asked for a path we walk the template directories and
+build an index of template name to absolute path for the whole process.  This
+follows the same rules as Django's filesystem and app_directories loaders,
+TEMPLATE_DIRS first and then each app in INSTALLED_APPS, and the first
+directory that has the file wins.  Anything the index doesn't know about
+(files added after it was built for example) falls back to the Django loaders.
+
+Call invalidate() if the template directories change out from under us.
+"""
+import os
+import threading
+
+from django.template import TemplateDoesNotExist
+from django.template.loaders import filesystem
+from django.template.loaders import app_directories
+
+from skylark.conf import settings
+
+__index = None
+__index_lock = threading.Lock()
+
+
+def get_template_dirs():
+    """
+    Every directory the filesystem and app_directories loaders look in, in
+    the order they look
+    """
+    return list(settings.TEMPLATE_DIRS) + \
+        list(app_directories.app_template_dirs)
+
+
+def build_index(template_dirs=None):
+    """
+    Walks the template directories, giving back a dictionary of template name
+    to absolute path
+    """
+    if template_dirs is None:
+        template_dirs = get_template_dirs()
+
+    index = {}
+    for template_dir in template_dirs:
+        template_dir = os.path.abspath(template_dir)
+        for dirpath, dirnames, filenames in os.walk(template_dir,
+                                                    followlinks=True):
+            relpath = os.path.relpath(dirpath, template_dir)
+            for filename in filenames:
+                if relpath == os.curdir:
+                    name = filename
+                else:
+                    name = os.path.join(relpath, filename)
+                name = name.replace(os.sep, '/')
+                if name not in index:
+                    index[name] = os.path.join(dirpath, filename)
+    return index
+
+
+def get_index():
+    global __index
+    if __index is None:
+        __index_lock.acquire()
+        try:
+            if __index is None:
+                __index = build_index()
+        finally:
+            __index_lock.release()
+    return __index
+
+
+def invalidate(template_name=None):
+    """
+    Forgets what we know about template_name, or everything if it's None
+    """
+    global __index
+    if template_name is None:
+        __index = None
+    elif __index is not None:
+        __index.pop(template_name, None)
+
+
+def _load_source_from_loaders(template_name):
+    # FIXME: we are using the Django file system loader here, this API
+    # might change in the future.
+    try:
+        source, filepath = \
+            filesystem._loader.load_template_source(template_name)
+    except TemplateDoesNotExist:
+        source, filepath = \
+            app_directories._loader.load_template_source(template_name)
+    return source, filepath
+
+
+def get_filepath(template_name):
+    """
+    The absolute path of the file for template_name, raises
+    TemplateDoesNotExist if it can't be found.  This doesn't read the file.
+    """
+    filepath = get_index().get(template_name)
+    if filepath is not None:
+        return filepath
+
+    # Not something we saw when we built the index, the loaders will know
+    source, filepath = _load_source_from_loaders(template_name)
+    get_index()[template_name] = filepath
+    return filepath
+
+
+def load_source(template_name):
+    """
+    Gives back the source code and filepath for a template while bypassing the
+    normal compile behavior
+    """
+    filepath = get_filepath(template_name)
+    try:
+        f = open(filepath)
+        try:
+            source = f.read().decode(settings.FILE_CHARSET)
+        finally:
+            f.close()
+    except IOError:
+        # It's been removed since we indexed it, maybe it's somewhere else now
+        invalidate(template_name)
+        source, filepath = _load_source_from_loaders(template_name)
+    return source, filepath
+
+
+def stat(template_name):
+    """
+    Performs an os.stat on the file behind template_name
+    """
+    filepath = get_filepath(template_name)
+    try:
+        return filepath, os.stat(filepath)
+    except OSError:
+        invalidate(template_name)
+        filepath = get_filepath(template_name)
+        return filepath, os.stat(filepath)
+
+
+def get_mtimes(template_names):
+    """
+    Builds a list of (filepath, modified time) for each template.  This can be
+    compared later with mtimes_are_current to see if anything has changed.
+    """
+    mtimes = []
+    for template_name in template_names:
+        filepath, st = stat(template_name)
+        mtimes.append((filepath, st.st_mtime))
+    return mtimes
+
+
+def mtimes_are_current(mtimes):
+    """
+    Given the output of get_mtimes, determine if all of the files are still
+    the same as when we looked at them last
+    """
+    for filepath, mtime in mtimes:
+        try:
+            if os.stat(filepath).st_mtime != mtime:
+                return False
+        except OSError:
+            # The file has been removed
+            return False
+    return True
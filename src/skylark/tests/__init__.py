@@ -1,6 +1,7 @@
 import os
 import shutil
 from time import time
+from tempfile import mkdtemp
 from django.http import HttpRequest
 from django.core.management import setup_environ
 
@@ -52,11 +53,19 @@ def get_request_fixture():
 
 
 def setup():
+    from skylark.plans import plan_options
+    plan_options(minify_javascript=True, fingerprint_static=False,
+        publish_referenced_images=False, inline_images_under=0)
+
     settings.DEBUG = True
     settings.SKYLARK_PLANS = 'mediadeploy'
     settings.SKYLARK_PLANS_DEFAULT = 'default'
     settings.SKYLARK_PLANS_ROLLUP_SALT = 'aaaaaaaaaaaaaaaa'
     settings.SKYLARK_ENABLE_TIDY = False
+    settings.SKYLARK_USE_BUILD_MANIFEST = False
+    settings.SKYLARK_MEDIA_WATCHER = None
+    settings.SKYLARK_PUBLISH_STRATEGY = 'copy'
+    settings.SKYLARK_MEDIA_CACHE = 'locmem'
 
 
 def teardown():
@@ -68,3 +77,36 @@ def teardown():
             shutil.rmtree(os.path.join(cachedir, topdir))
     except OSError:
         pass
+
+
+template_copy = None
+
+
+def setup_template_copy():
+    """
+    setup, and the planapp templates are found in a temporary copy that tests
+    can change without touching the ones in the source tree
+    """
+    global template_copy
+    from skylark import resolver
+
+    setup()
+
+    template_copy = mkdtemp()
+    templates = os.path.join(template_copy, 'templates')
+    shutil.copytree(os.path.join(projectdir, 'planapp', 'templates'),
+        templates)
+    settings.TEMPLATE_DIRS = (templates,) + tuple(settings.TEMPLATE_DIRS)
+    resolver.invalidate()
+
+
+def teardown_template_copy():
+    global template_copy
+    from skylark import resolver
+
+    teardown()
+
+    settings.TEMPLATE_DIRS = tuple(settings.TEMPLATE_DIRS)[1:]
+    resolver.invalidate()
+    shutil.rmtree(template_copy)
+    template_copy = None
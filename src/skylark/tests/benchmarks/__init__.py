@@ -0,0 +1,29 @@
+"""
+Micro-benchmarks for the hot spots in Django Skylark.
+
+These are not tests, run them directly from the src directory::
+
+    python -m skylark.tests.benchmarks.yamlload
+"""
+from timeit import default_timer
+
+
+def best_of(func, number=100, repeat=3):
+    """
+    Calls func number times, repeat times over, and gives back the best
+    average time per call in seconds
+    """
+    results = []
+    for i in range(repeat):
+        started = default_timer()
+        for j in xrange(number):
+            func()
+        results.append((default_timer() - started) / number)
+    return min(results)
+
+
+def report(name, seconds, baseline=None):
+    line = '%-40s %10.3f ms' % (name, seconds * 1000)
+    if baseline:
+        line += '  (%.1fx)' % (baseline / seconds)
+    print line
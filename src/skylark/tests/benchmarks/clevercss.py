@@ -0,0 +1,83 @@
+"""
+Times CleverCSS on a generated stylesheet with 10,000 rules, comparing the
+tokenizer that tries each rule in turn with the one that uses a single regular
+expression, then parsing and evaluating on their own.
+"""
+from skylark.processor import clevercss
+from skylark.tests.benchmarks import best_of, report
+from skylark.tests.reference import clevercss as clevercss_reference
+
+VARIABLES = """\
+base_padding = 2px
+border_color = #c0c0c0
+link_color = #ff0000
+text_color = navy
+font_stack = Verdana, Arial, 'Times New Roman', sans-serif
+"""
+
+RULE = """\
+div.rule%(i)d:
+    color: $text_color
+    font-family: $font_stack
+    border: 1px solid $border_color.darken(%(percent)d%%)
+    background: url(img/bg%(i)d.png) no-repeat
+    padding->
+        top: $base_padding + %(i)d
+        left: ($base_padding + 3) * 2
+    width: %(i)dpx / 4 + 10
+    a:
+        color: $link_color.brighten(%(percent)d%%)
+        &:hover:
+            color: rgb(%(percent)d%%, 20, 40)
+            content: "rule %(i)d"
+"""
+
+
+def get_stylesheet(rules=10000):
+    parts = [VARIABLES]
+    for i in xrange(rules):
+        parts.append(RULE % {'i': i, 'percent': i % 100})
+    return '\n'.join(parts)
+
+
+def get_values(source):
+    """
+    The (lineno, expression) pairs the parser hands to the tokenizer
+    """
+    root_rules, vars = clevercss.Parser().preparse(source)
+    values = vars.values()
+
+    def walk(rules):
+        for rule, children, defs in rules:
+            values.extend([(lineno, v) for lineno, k, v in defs])
+            walk(children)
+    walk(root_rules)
+    return [(lineno, v.rstrip(';')) for lineno, v in values]
+
+
+def main():
+    source = get_stylesheet()
+    values = get_values(source)
+    print 'Tokenizing %d expressions from a %d KB stylesheet' % (
+        len(values), len(source) / 1024)
+
+    def tokenize_all(tokenize):
+        def run():
+            for lineno, value in values:
+                tokenize(lineno, value)
+        return run
+
+    baseline = best_of(tokenize_all(clevercss_reference.tokenize), number=1)
+    report('reference tokenize', baseline)
+    report('tokenize', best_of(tokenize_all(clevercss.tokenize), number=1),
+        baseline)
+
+    report('Parser.parse', best_of(lambda: clevercss.Parser().parse(source),
+        number=1))
+    engine = clevercss.Engine(source)
+    report('Engine.to_css (already parsed)', best_of(engine.to_css, number=1))
+    report('convert', best_of(lambda: clevercss.convert(source), number=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Brightens a batch of colors with the CleverCSS color helpers, with NumPy if it
+is installed and without.
+"""
+import random
+
+from skylark.processor import clevercss
+from skylark.tests.benchmarks import best_of, report
+
+
+def main():
+    random.seed(0)
+    colors = [(random.randint(0, 255), random.randint(0, 255),
+        random.randint(0, 255)) for i in xrange(5000)]
+    print 'Brightening %d colors' % len(colors)
+
+    def brighten_one_at_a_time():
+        amount = clevercss.Value(20, '%')
+        for color in colors:
+            clevercss.brighten_color(clevercss.Color(color), None, amount)
+
+    def brighten_batch():
+        clevercss.brighten_colors(colors, 20)
+
+    baseline = best_of(brighten_one_at_a_time, number=3)
+    report('Color.brighten, one at a time', baseline)
+
+    numpy = clevercss.numpy
+    clevercss.numpy = None
+    try:
+        report('brighten_colors, pure Python', best_of(brighten_batch,
+            number=3), baseline)
+    finally:
+        clevercss.numpy = numpy
+
+    if numpy is not None:
+        report('brighten_colors, NumPy', best_of(brighten_batch, number=3),
+            baseline)
+    else:
+        print 'NumPy is not installed'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Compares the url() rewriter that copies the stylesheet for every url with the
+one that goes through it once, on the stylesheets in the chirp templates put
+together into one big rollup.
+"""
+from skylark import cssimgreplace
+from skylark.tests.benchmarks import best_of, report
+from skylark.tests.reference import cssimgreplace as cssimgreplace_reference
+from skylark.tests.test_cssimgreplace import get_stylesheets
+
+CSS_PATH = 'chirp/media/css/'
+CACHE_URL = 'http://testserver/media/cfcache/out/'
+
+
+def get_rollup(size=4 * 1024 * 1024):
+    stylesheets = [open(i).read() for i in get_stylesheets()]
+    parts = []
+    length = 0
+    copy = 0
+    while length < size:
+        # Every copy gets its own sprites so there are lots of distinct urls
+        for source in stylesheets:
+            source = source.replace('.png', '.%d.png' % copy)
+            parts.append(source)
+            length += len(source)
+        copy += 1
+    return '\n'.join(parts)
+
+
+def main():
+    source = get_rollup()
+    print 'Rewriting %d urls (%d distinct) in a %d KB stylesheet' % (
+        len(cssimgreplace.url_value_re.findall(source)),
+        len(set(cssimgreplace.url_value_re.findall(source))),
+        len(source) / 1024)
+
+    def rewrite(func):
+        return lambda: func(source, CSS_PATH, CACHE_URL)
+
+    baseline = best_of(rewrite(cssimgreplace_reference.relative_replace),
+        number=1)
+    report('reference relative_replace', baseline)
+    report('relative_replace', best_of(rewrite(cssimgreplace.relative_replace),
+        number=1), baseline)
+
+
+if __name__ == '__main__':
+    main()
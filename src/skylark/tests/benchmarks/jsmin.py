@@ -0,0 +1,41 @@
+"""
+Compares the character at a time jsmin with the one that works on runs of
+characters, on the Dojo files that end up in the chirp rollups.
+"""
+import os
+
+from skylark.tests import projectdir
+from skylark.tests.benchmarks import best_of, report
+from skylark.tests.reference import jsmin as jsmin_reference
+from skylark.utils import jsmin
+
+
+def get_sources():
+    dojodir = os.path.join(os.path.dirname(projectdir), 'templates', 'chirp',
+        'media', 'dojo')
+    sources = []
+    for filename in sorted(os.listdir(dojodir)):
+        if not filename.endswith('.js'):
+            continue
+        sources.append(open(os.path.join(dojodir, filename)).read())
+    return sources
+
+
+def main():
+    sources = get_sources()
+    print 'Minifying %d Dojo files, %d KB' % (len(sources),
+        sum([len(i) for i in sources]) / 1024)
+
+    def minify_all(func):
+        def run():
+            for source in sources:
+                func(source)
+        return run
+
+    baseline = best_of(minify_all(jsmin_reference.jsmin), number=1)
+    report('reference jsmin', baseline)
+    report('jsmin', best_of(minify_all(jsmin.jsmin), number=1), baseline)
+
+
+if __name__ == '__main__':
+    main()
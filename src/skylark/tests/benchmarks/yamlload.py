@@ -0,0 +1,61 @@
+"""
+Compares the pure Python YAML loader with the libyaml one (and our cache of
+parsed documents) on the YAML files from the dummyapp.
+"""
+import os
+
+import yaml
+from django.template import Context, Template
+
+from skylark.tests import projectdir
+from skylark.tests.benchmarks import best_of, report
+from skylark.utils import yamlloader
+
+
+def get_documents():
+    templatedir = os.path.join(projectdir, 'dummyapp', 'templates')
+    documents = []
+    for dirpath, dirnames, filenames in os.walk(templatedir):
+        for filename in filenames:
+            if not filename.endswith('.yaml'):
+                continue
+            source = open(os.path.join(dirpath, filename)).read()
+            rendered = Template(source).render(Context())
+            try:
+                yaml.load(rendered, Loader=yaml.SafeLoader)
+            except yaml.YAMLError:
+                # Some of these are broken on purpose
+                continue
+            documents.append(unicode.encode(rendered, 'utf-8'))
+    return documents
+
+
+def main():
+    documents = get_documents()
+    print 'Parsing %d YAML documents from the dummyapp' % len(documents)
+
+    def load_all(loader):
+        def run():
+            for document in documents:
+                yaml.load(document, Loader=loader)
+        return run
+
+    def load_cached():
+        for document in documents:
+            yamlloader.load(document)
+
+    baseline = best_of(load_all(yaml.SafeLoader))
+    report('yaml.SafeLoader', baseline)
+
+    if hasattr(yaml, 'CSafeLoader'):
+        report('yaml.CSafeLoader', best_of(load_all(yaml.CSafeLoader)),
+            baseline)
+    else:
+        print 'yaml.CSafeLoader is not available, PyYAML lacks libyaml'
+
+    report('skylark.utils.yamlloader (cached)', best_of(load_cached),
+        baseline)
+
+
+if __name__ == '__main__':
+    main()
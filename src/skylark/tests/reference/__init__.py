@@ -0,0 +1,5 @@
+"""
+Frozen copies of code that has since been rewritten to go faster.  The tests
+and benchmarks check the new versions against these, so don't change them
+along with the code they stand in for.
+"""
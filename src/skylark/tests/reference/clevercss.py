@@ -0,0 +1,253 @@
+"""
+The CleverCSS expression tokenizer as it was before it matched one regular
+expression per token, taken from the parse_expr method of the Parser.  Frozen,
+see skylark.tests.reference.
+"""
+import re
+
+
+# list of operators
+_operators = ['+', '-', '*', '/', '%', '(', ')', ';', ',']
+
+# units
+_units = ['em', 'ex', 'px', 'cm', 'mm', 'in', 'pt', 'pc', 'deg', 'rad'
+          'grad', 'ms', 's', 'Hz', 'kHz', '%']
+
+_colors = {
+    'aliceblue': '#f0f8ff',
+    'antiquewhite': '#faebd7',
+    'aqua': '#00ffff',
+    'aquamarine': '#7fffd4',
+    'azure': '#f0ffff',
+    'beige': '#f5f5dc',
+    'bisque': '#ffe4c4',
+    'black': '#000000',
+    'blanchedalmond': '#ffebcd',
+    'blue': '#0000ff',
+    'blueviolet': '#8a2be2',
+    'brown': '#a52a2a',
+    'burlywood': '#deb887',
+    'cadetblue': '#5f9ea0',
+    'chartreuse': '#7fff00',
+    'chocolate': '#d2691e',
+    'coral': '#ff7f50',
+    'cornflowerblue': '#6495ed',
+    'cornsilk': '#fff8dc',
+    'crimson': '#dc143c',
+    'cyan': '#00ffff',
+    'darkblue': '#00008b',
+    'darkcyan': '#008b8b',
+    'darkgoldenrod': '#b8860b',
+    'darkgray': '#a9a9a9',
+    'darkgreen': '#006400',
+    'darkkhaki': '#bdb76b',
+    'darkmagenta': '#8b008b',
+    'darkolivegreen': '#556b2f',
+    'darkorange': '#ff8c00',
+    'darkorchid': '#9932cc',
+    'darkred': '#8b0000',
+    'darksalmon': '#e9967a',
+    'darkseagreen': '#8fbc8f',
+    'darkslateblue': '#483d8b',
+    'darkslategray': '#2f4f4f',
+    'darkturquoise': '#00ced1',
+    'darkviolet': '#9400d3',
+    'deeppink': '#ff1493',
+    'deepskyblue': '#00bfff',
+    'dimgray': '#696969',
+    'dodgerblue': '#1e90ff',
+    'firebrick': '#b22222',
+    'floralwhite': '#fffaf0',
+    'forestgreen': '#228b22',
+    'fuchsia': '#ff00ff',
+    'gainsboro': '#dcdcdc',
+    'ghostwhite': '#f8f8ff',
+    'gold': '#ffd700',
+    'goldenrod': '#daa520',
+    'gray': '#808080',
+    'green': '#008000',
+    'greenyellow': '#adff2f',
+    'honeydew': '#f0fff0',
+    'hotpink': '#ff69b4',
+    'indianred': '#cd5c5c',
+    'indigo': '#4b0082',
+    'ivory': '#fffff0',
+    'khaki': '#f0e68c',
+    'lavender': '#e6e6fa',
+    'lavenderblush': '#fff0f5',
+    'lawngreen': '#7cfc00',
+    'lemonchiffon': '#fffacd',
+    'lightblue': '#add8e6',
+    'lightcoral': '#f08080',
+    'lightcyan': '#e0ffff',
+    'lightgoldenrodyellow': '#fafad2',
+    'lightgreen': '#90ee90',
+    'lightgrey': '#d3d3d3',
+    'lightpink': '#ffb6c1',
+    'lightsalmon': '#ffa07a',
+    'lightseagreen': '#20b2aa',
+    'lightskyblue': '#87cefa',
+    'lightslategray': '#778899',
+    'lightsteelblue': '#b0c4de',
+    'lightyellow': '#ffffe0',
+    'lime': '#00ff00',
+    'limegreen': '#32cd32',
+    'linen': '#faf0e6',
+    'magenta': '#ff00ff',
+    'maroon': '#800000',
+    'mediumaquamarine': '#66cdaa',
+    'mediumblue': '#0000cd',
+    'mediumorchid': '#ba55d3',
+    'mediumpurple': '#9370db',
+    'mediumseagreen': '#3cb371',
+    'mediumslateblue': '#7b68ee',
+    'mediumspringgreen': '#00fa9a',
+    'mediumturquoise': '#48d1cc',
+    'mediumvioletred': '#c71585',
+    'midnightblue': '#191970',
+    'mintcream': '#f5fffa',
+    'mistyrose': '#ffe4e1',
+    'moccasin': '#ffe4b5',
+    'navajowhite': '#ffdead',
+    'navy': '#000080',
+    'oldlace': '#fdf5e6',
+    'olive': '#808000',
+    'olivedrab': '#6b8e23',
+    'orange': '#ffa500',
+    'orangered': '#ff4500',
+    'orchid': '#da70d6',
+    'palegoldenrod': '#eee8aa',
+    'palegreen': '#98fb98',
+    'paleturquoise': '#afeeee',
+    'palevioletred': '#db7093',
+    'papayawhip': '#ffefd5',
+    'peachpuff': '#ffdab9',
+    'peru': '#cd853f',
+    'pink': '#ffc0cb',
+    'plum': '#dda0dd',
+    'powderblue': '#b0e0e6',
+    'purple': '#800080',
+    'red': '#ff0000',
+    'rosybrown': '#bc8f8f',
+    'royalblue': '#4169e1',
+    'saddlebrown': '#8b4513',
+    'salmon': '#fa8072',
+    'sandybrown': '#f4a460',
+    'seagreen': '#2e8b57',
+    'seashell': '#fff5ee',
+    'sienna': '#a0522d',
+    'silver': '#c0c0c0',
+    'skyblue': '#87ceeb',
+    'slateblue': '#6a5acd',
+    'slategray': '#708090',
+    'snow': '#fffafa',
+    'springgreen': '#00ff7f',
+    'steelblue': '#4682b4',
+    'tan': '#d2b48c',
+    'teal': '#008080',
+    'thistle': '#d8bfd8',
+    'tomato': '#ff6347',
+    'turquoise': '#40e0d0',
+    'violet': '#ee82ee',
+    'wheat': '#f5deb3',
+    'white': '#ffffff',
+    'whitesmoke': '#f5f5f5',
+    'yellow': '#ffff00',
+    'yellowgreen': '#9acd32'
+}
+
+# partial regular expressions for the expr parser
+_r_number = '\d+(?:\.\d+)?'
+_r_string = r"(?:'(?:[^'\\]*(?:\\.[^'\\]*)*)'|" \
+            r'\"(?:[^"\\]*(?:\\.[^"\\]*)*)")'
+_r_call = r'([a-zA-Z_][a-zA-Z0-9_]*)\('
+
+# regular expressions for the expr parser
+_operator_re = re.compile('|'.join(re.escape(x) for x in _operators))
+_whitespace_re = re.compile(r'\s+')
+_number_re = re.compile(_r_number + '(?![a-zA-Z0-9_])')
+_number_re = re.compile(_r_number + '(?![a-zA-Z0-9_])')
+_value_re = re.compile(r'(%s)(%s)(?![a-zA-Z0-9_])' % (_r_number, '|'.join(_units)))
+_color_re = re.compile(r'#' + ('[a-fA-f0-9]{1,2}' * 3))
+_string_re = re.compile('%s|([^\s*/();,.+$]+|\.(?!%s))+' % (_r_string, _r_call))
+_webkit_re = re.compile(r'\-webkit\-(.*)$')
+_url_re = re.compile(r'url\(\s*(%s|.*?)\s*\)' % _r_string)
+_rgba_re = re.compile(r'rgba\(\s*(%s|.*?)\s*\)' % _r_string)
+_var_re = re.compile(r'(?<!\\)\$(?:([a-zA-Z_][a-zA-Z0-9_]*)|'
+                     r'\{([a-zA-Z_][a-zA-Z0-9_]*)\})')
+_call_re = re.compile(r'\.' + _r_call)
+
+
+class ParserError(Exception):
+    """
+    Raised on syntax errors.
+    """
+
+    def __init__(self, lineno, message):
+        self.lineno = lineno
+        Exception.__init__(self, message)
+
+    def __str__(self):
+        return '%s (line %s)' % (
+            self.message,
+            self.lineno
+        )
+
+
+def tokenize(lineno, s):
+    """
+    The tokens of `s` and the error that stopped us, or `None` if we got to
+    the end.  Made out of the generator that was in Parser.parse_expr.
+    """
+    def parse():
+        pos = 0
+        end = len(s)
+
+        def process(token, group=0):
+            return lambda m: (m.group(group), token)
+
+        def process_string(m):
+            value = m.group(0)
+            try:
+                if value[:1] == value[-1:] and value[0] in '"\'':
+                    value = value[1:-1].encode('utf-8') \
+                                       .decode('string-escape') \
+                                       .encode('utf-8')
+                elif value == 'rgb':
+                    return None, 'rgb'
+                elif value in _colors:
+                    return value, 'color'
+            except UnicodeError:
+                raise ParserError(lineno, 'invalid string escape')
+            return value, 'string'
+
+        rules = ((_webkit_re, process('webkit', 1)),
+                 (_operator_re, process('op')),
+                 (_call_re, process('call', 1)),
+                 (_value_re, lambda m: (m.groups(), 'value')),
+                 (_color_re, process('color')),
+                 (_number_re, process('number')),
+                 (_rgba_re, process('rgba', 1)),
+                 (_url_re, process('url', 1)),
+                 (_string_re, process_string),
+                 (_var_re, lambda m: (m.group(1) or m.group(2), 'var')),
+                 (_whitespace_re, None))
+
+        while pos < end:
+            for rule, processor in rules:
+                m = rule.match(s, pos)
+                if m is not None:
+                    if processor is not None:
+                        yield processor(m)
+                    pos = m.end()
+                    break
+            else:
+                raise ParserError(lineno, 'Syntax error')
+
+    tokens = []
+    try:
+        for token in parse():
+            tokens.append(token)
+    except (ParserError, ValueError), e:
+        return tokens, e
+    return tokens, None
@@ -489,5 +489,101 @@ def test_handles_snippets_inside_page_assemblies():
     assert content.count("dummyapp/snippet/media/js/base.js") == 1
     assert content.count("dummyapp/page/media/js/sample.js") == 1
 
+
+@with_setup(setup, teardown)
+def test_caches_page_instructions():
+    class CountingAssembly(PageAssembly):
+        built = 0
+
+        def add_page_instructions(self, page_instructions, file):
+            CountingAssembly.built += 1
+            super(CountingAssembly, self).add_page_instructions(
+                page_instructions, file)
+
+    BaseAssembly.clear_page_instructions_cache()
+
+    def dumps(title):
+        request = get_request_fixture()
+        c = RequestContext(request, { 'title': unicode(title) })
+        pa = CountingAssembly('dummyapp/page/escapetitle.yaml', c,
+            cache_vars=('title',))
+        return pa.dumps()
+
+    assert 'Title one' in dumps('Title one')
+    assert 'Title one' in dumps('Title one')
+    assert CountingAssembly.built == 1
+
+    # A different value for one of the cache_vars means different yaml
+    assert 'Title two' in dumps('Title two')
+    assert CountingAssembly.built == 2
+
+    # Changing the yaml file itself will also rebuild the instructions
+    yaml_path = template.loader.get_template(
+        'dummyapp/page/escapetitle.yaml').origin.name
+    mtime = os.stat(yaml_path).st_mtime
+    os.utime(yaml_path, (mtime + 10, mtime + 10))
+    try:
+        assert 'Title one' in dumps('Title one')
+        assert CountingAssembly.built == 3
+    finally:
+        os.utime(yaml_path, (mtime, mtime))
+
+    BaseAssembly.clear_page_instructions_cache()
+
+
+@with_setup(setup, teardown)
+def test_page_instructions_cache_skips_values_without_a_key():
+    from skylark.assembly import cache_key_value
+
+    class Unequal(object):
+        def __str__(self):
+            return 'Only equal to itself'
+
+    class CountingAssembly(PageAssembly):
+        built = 0
+
+        def add_page_instructions(self, page_instructions, file):
+            CountingAssembly.built += 1
+            super(CountingAssembly, self).add_page_instructions(
+                page_instructions, file)
+
+    BaseAssembly.clear_page_instructions_cache()
+
+    assert cache_key_value(u'title') == u'title'
+    assert cache_key_value([1, 2]) == cache_key_value([1, 2])
+    py.test.raises(TypeError, cache_key_value, Unequal())
+    py.test.raises(TypeError, cache_key_value, [lambda: None])
+
+    def dumps(title, users=None):
+        request = get_request_fixture()
+        c = RequestContext(request, { 'title': title, 'users': users })
+        pa = CountingAssembly('dummyapp/page/escapetitle.yaml', c,
+            cache_vars=('title', 'users'))
+        return pa.dumps()
+
+    # Built every time, and nothing is left behind in the cache
+    dumps(Unequal())
+    dumps(Unequal())
+    assert CountingAssembly.built == 2
+    assert len(BaseAssembly._BaseAssembly__page_instructions_cache) == 0
+
+    # The same goes for what's inside a list, and the QuerySet is never
+    # evaluated to find out what it holds
+    from django.contrib.auth.models import User
+    users = User.objects.all()
+    assert cache_key_value([1, (2, {'a': 3})]) == \
+        cache_key_value([1, (2, {'a': 3})])
+    py.test.raises(TypeError, cache_key_value, [users])
+    py.test.raises(TypeError, cache_key_value, {'users': (1, users)})
+
+    dumps(u'title', [users])
+    dumps(u'title', [users])
+    assert CountingAssembly.built == 4
+    assert len(BaseAssembly._BaseAssembly__page_instructions_cache) == 0
+    assert users._result_cache is None
+
+    BaseAssembly.clear_page_instructions_cache()
+
+
 global handler_called
 handler_called = False
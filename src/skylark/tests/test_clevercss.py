@@ -1,4 +1,6 @@
+import os
 from skylark.processor import clevercss
+from skylark.tests.reference import clevercss as clevercss_reference
 
 def test_webkit_properties():
     property ="""div:
@@ -9,3 +11,202 @@ def test_webkit_properties():
 }"""
 
     assert clevercss.convert(property) == expected 
+
+
+def get_example():
+    """
+    The example from the CleverCSS docstring
+    """
+    import re
+    return '\n'.join(l[8:].rstrip() for l in
+        re.compile(r'Example::\n(.*?)__END__(?ms)')
+        .search(clevercss.__doc__).group(1).splitlines())
+
+
+def test_engine_dumps_and_loads():
+    example = get_example()
+    engine = clevercss.Engine.loads(clevercss.Engine(example).dumps())
+
+    assert engine.to_css() == clevercss.convert(example)
+
+
+def test_parsed_stylesheets_are_cached():
+    import shutil
+    import tempfile
+    from skylark.tests import settings
+    from skylark.plans.base import process_clevercss
+
+    parsed = []
+    parse = clevercss.Parser.parse
+
+    def counting_parse(self, source):
+        parsed.append(source)
+        return parse(self, source)
+
+    directory = tempfile.mkdtemp()
+    original_directory = settings.SKYLARK_CLEVERCSS_CACHE_DIRECTORY
+    settings.SKYLARK_CLEVERCSS_CACHE_DIRECTORY = directory
+    clevercss.Parser.parse = counting_parse
+    try:
+        example = get_example()
+        expected = clevercss.convert(example)
+
+        assert process_clevercss(example) == expected
+        assert process_clevercss(example) == expected
+        assert len(parsed) == 2
+
+        # Something we can't load is parsed again
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                open(os.path.join(dirpath, filename), 'wb').write('junk')
+
+        assert process_clevercss(example) == expected
+        assert len(parsed) == 3
+    finally:
+        clevercss.Parser.parse = parse
+        settings.SKYLARK_CLEVERCSS_CACHE_DIRECTORY = original_directory
+        shutil.rmtree(directory)
+
+
+def test_tokenizer_agrees_with_reference():
+    expressions = [
+        '1px solid $border_color.darken(30%)',
+        '($base_padding + 3) * 2 / 4 % 3 - -1',
+        "Verdana, Arial, 'Times New Roman'; sans-serif",
+        'url( "img/bg 1.png" ) no-repeat rgba(0, 0, 0, .5)',
+        'rgb(10%, 20, 40) #fff #a0B1c2 navy ${x}\\$y',
+        '-webkit-gradient(linear, 0% 0%, from(#E0E0E0))',
+        '"Hello World".length() * 20kHz 2s',
+        '"never ends',
+        "'bad \\x escape'",
+        '1 ! 2 $ 3',
+        '',
+    ]
+    for lineno, expression in enumerate(expressions):
+        tokens, error = clevercss.tokenize(lineno, expression)
+        expected_tokens, expected_error = clevercss_reference.tokenize(
+            lineno, expression)
+        assert tokens == expected_tokens
+        assert repr(error) == repr(expected_error)
+        if error is not None:
+            assert str(error) == str(expected_error)
+
+
+def test_constants_are_folded():
+    engine = clevercss.Engine('a:\n    width: (1px + 2px) * 3 $x\n'
+                              '    color: #fff.darken(10%)\n')
+    width, color = [expr for key, expr in engine.rules[0][1]]
+
+    assert isinstance(width, clevercss.ImplicitConcat)
+    assert isinstance(width.nodes[0], clevercss.Value)
+    assert width.nodes[0].value == 9
+    assert isinstance(width.nodes[1], clevercss.Var)
+    assert isinstance(color, clevercss.Color)
+
+
+def test_variables_are_evaluated_once():
+    brightened = []
+    brighten = clevercss.Color.methods['brighten']
+
+    def counting_brighten(color, context, amount=None):
+        brightened.append(color)
+        return brighten(color, context, amount)
+
+    clevercss.Color.methods['brighten'] = counting_brighten
+    try:
+        css = clevercss.convert('base = #808080\n'
+                                'light = $base.brighten(10%)\n'
+                                'a:\n    color: $light\n'
+                                'b:\n    background: $light\n')
+    finally:
+        clevercss.Color.methods['brighten'] = brighten
+
+    assert len(brightened) == 1
+    assert css.count('#0c0c0c') == 2
+
+
+def test_darken_gives_the_same_color_each_time():
+    css = clevercss.convert('dark = #808080.darken($amount)\namount = 10\n'
+                            'a:\n    color: $dark\n'
+                            'b:\n    color: #808080.darken($amount)\n'
+                            'c:\n    color: #808080.darken($amount)\n')
+
+    assert css.count('#666666') == 3
+
+
+def test_css_can_be_streamed():
+    import io
+    example = get_example()
+    expected = clevercss.convert(example)
+
+    engine = clevercss.Engine(io.StringIO(
+        unicode(example).replace('\n', '\r\n')))
+    chunks = list(engine.iter_css())
+
+    assert len(chunks) == len(engine.rules)
+    assert u''.join(chunks) == expected
+
+    stream = io.BytesIO()
+    engine.write_css(stream, encoding='utf-8')
+
+    assert stream.getvalue().decode('utf-8') == expected
+
+
+def test_batch_colors_agree_with_single_colors():
+    import operator
+
+    colors = [(r, g, b) for r in (0, 37, 128, 255) for g in (0, 90, 255)
+              for b in (0, 12, 201, 255)]
+    amounts = [(10, True), (0, True), (250, True), (-30, True), (10, False),
+               (-45, False), (150, False)]
+
+    def single(color, attribute, amount, relative):
+        if relative:
+            amount = clevercss.Value(amount, '%')
+        else:
+            amount = clevercss.Number(amount)
+        return clevercss.adjust_color(clevercss.Color(color), amount,
+                                      attribute).value
+
+    with_numpy = clevercss.numpy
+    try:
+        # With NumPy if we have it, then without
+        for numpy in (with_numpy, None):
+            clevercss.numpy = numpy
+            for attribute in ('hue', 'lightness', 'saturation'):
+                for amount, relative in amounts:
+                    expected = [single(color, attribute, amount, relative)
+                                for color in colors]
+                    assert clevercss.adjust_colors(colors, attribute, amount,
+                        relative) == expected
+
+            assert clevercss.darken_colors(colors, 20, False) == \
+                clevercss.brighten_colors(colors, -20, False)
+
+            for other in (40, (10, 200, 255)):
+                assert clevercss.calc_colors(colors, other, operator.sub) == \
+                    [clevercss.Color(color).sub(clevercss.Color(other)
+                        if isinstance(other, tuple) else
+                        clevercss.Number(other), None).value
+                     for color in colors]
+    finally:
+        clevercss.numpy = with_numpy
+
+
+def test_batch_colors_divide_by_zero_either_way():
+    import operator
+    import py.test
+
+    with_numpy = clevercss.numpy
+    try:
+        for numpy in (with_numpy, None):
+            clevercss.numpy = numpy
+            # Enough colors for NumPy and too few for it
+            for count in (clevercss.NUMPY_THRESHOLD, 1):
+                colors = [(10, 20, 30)] * count
+                for method in (operator.div, operator.mod):
+                    for other in (0, (5, 0, 5)):
+                        py.test.raises(ZeroDivisionError,
+                            clevercss.calc_colors, colors, other, method)
+    finally:
+        clevercss.numpy = with_numpy
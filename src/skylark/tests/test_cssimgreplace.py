@@ -1,3 +1,6 @@
+import os
+import re
+
 import py.test
 
 from nose.tools import with_setup
@@ -5,6 +8,8 @@ from nose.plugins.attrib import attr
 from nose.plugins.skip import SkipTest
 
 from skylark import cssimgreplace
+from skylark.tests.reference import cssimgreplace as cssimgreplace_reference
+from skylark.tests import projectdir
 
 RAW = """
 /* Common use case */
@@ -93,3 +98,69 @@ def test_will_replace_url_values():
         'dummyapp/page/media/css/',
         'http://testserver/media/cfcache/out/')
     assert result == EXPECTED
+
+
+DATA_URI_RE = re.compile(r"""url\(\s*["']?\s*data:[^)]*\)""")
+
+
+def get_stylesheets():
+    templatedir = os.path.join(os.path.dirname(projectdir), 'templates')
+    for dirpath, dirnames, filenames in os.walk(templatedir):
+        for filename in sorted(filenames):
+            if filename.endswith('.css'):
+                yield os.path.join(dirpath, filename)
+
+
+def test_agrees_with_reference():
+    sources = [RAW, RAW.replace('"', '')] + \
+        [open(i).read() for i in get_stylesheets()]
+    for source in sources:
+        # The reference points data: URIs at the cache too, they're meant to
+        # be left alone now
+        source = DATA_URI_RE.sub('none', source)
+        for cache_base_url in ('http://testserver/media/cfcache/out/', '/',):
+            expected = cssimgreplace_reference.relative_replace(source,
+                'dummyapp/page/media/css/', cache_base_url)
+            result = cssimgreplace.relative_replace(source,
+                'dummyapp/page/media/css/', cache_base_url)
+            assert result == expected
+
+
+def test_referenced_paths():
+    source = RAW + """
+.class {
+    background: white url("../images/img1.gif?v=2");
+    src: url(../fonts/font.eot#iefix) url(data:image/gif;base64,R0lGOD==);
+}
+"""
+    paths = cssimgreplace.referenced_paths(source, 'dummyapp/page/media/css/')
+
+    assert paths == [
+        'dummyapp/page/media/images/img1.gif',
+        'dummyapp/page/media/css/img1.gif',
+        'dummyapp/page2/images/img1.gif',
+        'dummyapp/crazy\\\\page/images/img1.gif',
+        'dummyapp/page/media/fonts/font.eot']
+
+
+def test_will_inline_url_values():
+    source = cssimgreplace.relative_replace(RAW + """
+.class {
+    background: white url(data:image/gif;base64,R0lGOD==);
+}
+""", 'dummyapp/page/media/css/', 'http://testserver/media/cfcache/out/')
+
+    def data_uri(path):
+        if path == 'dummyapp/page/media/images/img1.gif':
+            return 'data:image/gif;base64,R0lGOD=='
+        return None
+
+    result = cssimgreplace.inline_replace(source,
+        'http://testserver/media/cfcache/out/', data_uri)
+
+    assert result.count('url(data:image/gif;base64,R0lGOD==)') == 2
+    assert 'url("data:image/gif;base64,R0lGOD==")' in result
+    assert "url('data:image/gif;base64,R0lGOD==')" in result
+    assert 'media/images/img1.gif' not in result
+    assert 'url("http://testserver/media/cfcache/out/dummyapp/page2' \
+        '/images/img1.gif")' in result
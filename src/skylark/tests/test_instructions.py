@@ -0,0 +1,30 @@
+from skylark.instructions import PageInstructions
+
+from skylark.tests import *
+
+
+def test_part_exists_follows_changes():
+    pi = PageInstructions()
+    pi.add({
+        'js': [{'static': 'app/a.js'}, {'static': 'app/b.js'},
+               {'static': 'app/a.js'}],
+        'css': [{'url': 'http://example.com/a.css'}]}, 'app/page.yaml')
+
+    assert [i['static'] for i in pi.js] == ['app/a.js', 'app/b.js']
+    assert pi.part_exists({'static': 'app/b.js'})
+    assert pi.part_exists({'url': 'http://example.com/a.css'})
+    assert not pi.part_exists({'static': 'app/c.js'})
+
+    # Assigning a new list is picked up
+    pi.js = [i for i in pi.js if i['static'] == 'app/a.js']
+    assert not pi.part_exists({'static': 'app/b.js'})
+
+    other = PageInstructions()
+    other.add({'js': [{'static': 'app/b.js'}, {'static': 'app/a.js'}]},
+        'app/other.yaml')
+    other.pipe_media_to(pi)
+
+    assert [i['static'] for i in pi.js] == ['app/a.js', 'app/b.js']
+    assert other.js == []
+    assert not other.part_exists({'static': 'app/a.js'})
+    assert pi.piped_yaml == ['app/other.yaml']
@@ -1,5 +1,6 @@
 import py.test
 import os
+import re
 from time import sleep
 
 from nose.tools import with_setup
@@ -57,11 +58,111 @@ def test_can_change_deploy_plan_name():
     py.test.raises(MissingMediaPlan, get_for_context, context, render_full_page)
 
 
+@with_setup(setup, teardown)
+def test_plans_share_state():
+    context = {}
+
+    settings.SKYLARK_PLANS = 'mediadeploy_reusable'
+    first = get_for_context(context, True)
+    second = get_for_context(context, True)
+
+    assert first is not second
+    assert first.state is second.state
+    assert first.cache_root == os.path.join(cachedir, 'out')
+
+    # Each kind of plan has its own
+    assert get_for_context(context, False).state is not first.state
+
+
+@with_setup(setup, teardown)
+def test_publish_strategies_link_unprocessed_files():
+    from skylark import resolver
+    from skylark.utils import publish
+
+    static_js = 'planapp/page/media/js/static.js'
+    static_css = 'planapp/page/media/css/static.css'
+    image = 'planapp/page/media/img/uses1.gif'
+
+    settings.SKYLARK_PUBLISH_STRATEGY = 'symlink'
+
+    request = get_request_fixture()
+    c = RequestContext(request)
+    pa = PageAssembly('planapp/page/full.yaml', c)
+    content = pa.dumps()
+
+    # Nothing has to be done to this one, so it's linked
+    filename = os.path.join(cachedir, 'out', static_js)
+    assert os.path.islink(filename)
+    assert os.readlink(filename) == resolver.get_filepath(static_js)
+
+    # But this one is processed with clevercss
+    assert not os.path.islink(os.path.join(cachedir, 'out', static_css))
+
+    assert os.path.islink(os.path.join(cachedir, 'out', image))
+
+    settings.SKYLARK_PUBLISH_STRATEGY = 'hardlink'
+
+    request = get_request_fixture()
+    c = RequestContext(request)
+    pa = PageAssembly('planapp/page/full.yaml', c)
+    content = pa.dumps()
+
+    for name in (static_js, image,):
+        filename = os.path.join(cachedir, 'out', name)
+        assert not os.path.islink(filename)
+        assert os.path.samefile(filename, resolver.get_filepath(name))
+
+    settings.SKYLARK_PUBLISH_STRATEGY = 'not a strategy'
+    py.test.raises(ValueError, publish.get_strategy)
+
+
+@with_setup(setup, teardown)
+def test_hardlinks_that_fall_back_to_copies_are_published_once():
+    from skylark.utils import publish
+
+    settings.SKYLARK_PUBLISH_STRATEGY = 'hardlink'
+    settings.DEBUG = False
+
+    published = []
+
+    def counting_publish(source, destination, strategy=None):
+        published.append(destination)
+        return publish_file(source, destination, strategy)
+
+    def no_link(source, destination):
+        # Like the cache being on another file system
+        raise OSError(18, 'Invalid cross-device link')
+
+    publish_file = publish.publish
+    link = os.link
+    publish.publish = counting_publish
+    os.link = no_link
+    try:
+        request = get_request_fixture()
+        c = RequestContext(request)
+        content = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        filename = os.path.join(cachedir, 'out',
+            'planapp/page/media/js/static.js')
+        assert filename in published
+        assert os.stat(filename).st_nlink == 1
+
+        published = []
+        request = get_request_fixture()
+        c = RequestContext(request)
+        content = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        assert published == []
+    finally:
+        publish.publish = publish_file
+        os.link = link
+
+
 @with_setup(setup, teardown)
 def test_deploy_reusable():
-    hash_js1 = '96936cfbde05fe1cce209c7f344dbd08'
-    hash_js2 = 'd921f357906a0e5e06da6a704376247b'
-    hash_css = 'f27f963509901f608889f688b1e39f72'
+    hash_js1 = '98eba2231df777b814afdf9f70d59bd9'
+    hash_js2 = '131370b409d5651d9c89eb38e6acf915'
+    hash_css = '1db1e5d3dfa562390032fc38457e35a3'
 
     settings.DEBUG = False
     settings.SKYLARK_PLANS = 'mediadeploy_reusable'
@@ -75,7 +176,7 @@ def test_deploy_reusable():
     jsfile = get_contents(
         os.path.join(cachedir, 'out', '%s.js' % hash_js1)
     )
-    assert 'var static_uses2=null;var static_uses1=null;' in jsfile
+    assert 'var static_uses2=null;\nvar static_uses1=null;' in jsfile
 
     jsfile = get_contents(
         os.path.join(cachedir, 'out', '%s.js' % hash_js2)
@@ -121,8 +222,8 @@ def test_deploy_reusable():
 
 @with_setup(setup, teardown)
 def test_deploy_fewest():
-    hash_css = 'a30e20a6a1d62976266b612a7e5d634a'
-    hash_js = '99cd70ab43d662a64aa33c794433295a'
+    hash_css = '26095485f48d5b031c0cf984ce5dbde3'
+    hash_js = '6c087fac6caa186ba5fabf171eecf520'
 
     settings.SKYLARK_PLANS = 'mediadeploy_fewest'
 
@@ -186,7 +287,7 @@ def test_deploy_fewest():
 
 @with_setup(setup, teardown)
 def test_deploy_fewest_instrumented():
-    hash_js = 'cb0aa470231a819d45ee02783f5fc468'
+    hash_js = '88a83948cbd16ffa1a3e30b1993d1768'
 
     chirp.instrument_site(True)
     settings.SKYLARK_PLANS = 'mediadeploy_fewest'
@@ -221,7 +322,7 @@ def test_missing_rollup_requirement():
 
 @with_setup(setup, teardown)
 def test_deploy_reusable_no_js_minifying():
-    hash_js = 'd921f357906a0e5e06da6a704376247b'
+    hash_js = '503c7281b626e7f010bd872d86db8372'
 
     settings.SKYLARK_PLANS = 'mediadeploy_reusable'
 
@@ -243,11 +344,33 @@ def test_deploy_reusable_no_js_minifying():
     assert '// summary:' in jsfile
 
 
+@with_setup(setup, teardown)
+def test_rollups_are_built_again_when_the_options_change():
+    settings.SKYLARK_PLANS = 'mediadeploy_reusable'
+
+    def get_rollups():
+        request = get_request_fixture()
+        c = RequestContext(request)
+        content = PageAssembly('planapp/page/full.yaml', c).dumps()
+        return re.findall(r'cfcache/out/([0-9a-f]{32}\.js)', content)
+
+    minified = get_rollups()
+
+    plan_options(minify_javascript=False)
+    not_minified = get_rollups()
+    assert not set(minified) & set(not_minified)
+    for name in not_minified:
+        assert '\n\n' in get_contents(os.path.join(cachedir, 'out', name))
+
+    plan_options(minify_javascript=True)
+    assert get_rollups() == minified
+
+
 @with_setup(setup, teardown)
 def test_will_not_needlessly_rollup():
     settings.SKYLARK_PLANS = 'mediadeploy_reusable'
 
-    hash_js1 = 'd921f357906a0e5e06da6a704376247b'
+    hash_js1 = '131370b409d5651d9c89eb38e6acf915'
     filename = os.path.join(cachedir, 'out', '%s.js' % hash_js1)
 
     request = get_request_fixture()
@@ -271,6 +394,338 @@ def test_will_not_needlessly_rollup():
     assert first_listing == os.listdir(os.path.join(cachedir, 'out'))
 
 
+@with_setup(setup_template_copy, teardown_template_copy)
+def test_watcher_skips_stat_until_something_changes():
+    from skylark import resolver
+    from skylark.plans.base import BasePlan
+    from skylark.watcher import get_watcher
+
+    settings.SKYLARK_PLANS = 'mediadeploy_reusable'
+    settings.SKYLARK_MEDIA_WATCHER = 'poll'
+    settings.SKYLARK_MEDIA_WATCHER_INTERVAL = 0.1
+
+    def render():
+        request = get_request_fixture()
+        c = RequestContext(request)
+        return PageAssembly('planapp/page/full.yaml', c).dumps()
+
+    first = render()
+
+    stats = []
+    get_media_stat = BasePlan._get_media_stat
+
+    def counting_stat(self, template_name):
+        stats.append(template_name)
+        return get_media_stat(self, template_name)
+
+    BasePlan._get_media_stat = counting_stat
+    try:
+        second = render()
+
+        assert first == second
+        assert 'planapp/page/media/js/static_uses1.js' not in stats
+
+        source = resolver.get_filepath(
+            'planapp/page/media/js/static_uses1.js')
+        mtime = os.stat(source).st_mtime + 10
+        os.utime(source, (mtime, mtime))
+        get_watcher().poll()
+
+        render()
+
+        assert 'planapp/page/media/js/static_uses1.js' in stats
+    finally:
+        BasePlan._get_media_stat = get_media_stat
+        settings.SKYLARK_MEDIA_WATCHER = None
+
+
+def test_polling_watcher_keeps_going_after_an_error():
+    import threading
+    from skylark.watcher import PollingWatcher
+
+    watcher = PollingWatcher(0.01)
+    polled = []
+    polled_again = threading.Event()
+
+    def poll():
+        polled.append(True)
+        if len(polled) == 1:
+            raise OSError('Permission denied')
+        polled_again.set()
+
+    watcher.poll = poll
+    watcher.watch('group', [__file__])
+    assert not watcher.changed('group')
+
+    polled_again.wait(5.0)
+
+    # We couldn't tell what changed so everything did
+    assert len(polled) > 1
+    assert watcher.changed('group')
+
+
+@with_setup(setup, teardown)
+def test_processed_media_is_cached():
+    from skylark.plans.base import BasePlan, process_clevercss
+
+    processed = []
+
+    def counting_clevercss(source):
+        processed.append(source)
+        return process_clevercss(source)
+
+    processing_funcs = BasePlan.processing_funcs
+    BasePlan.processing_funcs = dict(processing_funcs,
+        clevercss=counting_clevercss)
+    try:
+        request = get_request_fixture()
+        c = RequestContext(request)
+        content = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        # Each file that uses clevercss
+        assert len(processed) == 3
+
+        # Even with DEBUG on, the second time they come out of the cache
+        request = get_request_fixture()
+        c = RequestContext(request)
+        content = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        assert len(processed) == 3
+    finally:
+        BasePlan.processing_funcs = processing_funcs
+
+
+@with_setup(setup, teardown)
+def test_rollups_are_minified_a_file_at_a_time():
+    from skylark.plans import reusable
+
+    settings.SKYLARK_PLANS = 'mediadeploy_reusable'
+
+    minified = []
+
+    def counting_jsmin(source):
+        minified.append(source)
+        return jsmin(source)
+
+    jsmin = reusable.jsmin
+    reusable.jsmin = counting_jsmin
+    try:
+        request = get_request_fixture()
+        c = RequestContext(request)
+        first = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        assert len(minified) > 2
+
+        # Throwing the rollups away builds them again, out of the minified
+        # files we already have
+        teardown()
+        minified = []
+
+        request = get_request_fixture()
+        c = RequestContext(request)
+        second = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        assert first == second
+        assert minified == []
+    finally:
+        reusable.jsmin = jsmin
+
+
+@with_setup(setup, teardown)
+def test_css_urls_are_fixed_a_file_at_a_time():
+    from skylark.plans import base
+
+    settings.SKYLARK_PLANS = 'mediadeploy_reusable'
+
+    fixed = []
+
+    def counting_relative_replace(source, css_path, cache_base_url):
+        fixed.append(source)
+        return relative_replace(source, css_path, cache_base_url)
+
+    relative_replace = base.cssimgreplace.relative_replace
+    base.cssimgreplace.relative_replace = counting_relative_replace
+    try:
+        request = get_request_fixture()
+        c = RequestContext(request)
+        first = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        assert [i for i in fixed if 'url(../img/uses1.gif)' in i]
+
+        # The rollups are built again out of what we fixed last time, only
+        # inline media has to be done again
+        teardown()
+        fixed = []
+
+        request = get_request_fixture()
+        c = RequestContext(request)
+        second = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+        assert first == second
+        assert fixed == [u'.inline {\n    color: black;\n}\n']
+    finally:
+        base.cssimgreplace.relative_replace = relative_replace
+
+
+@with_setup(setup_template_copy, teardown_template_copy)
+def test_assets_are_synced_when_they_change():
+    from skylark import resolver
+    from skylark.utils import sync
+    from skylark.watcher import get_watcher
+
+    synced = []
+    sync_directory = sync.sync_directory
+
+    def counting_sync(source, destination, *args, **kwargs):
+        synced.append(source)
+        return sync_directory(source, destination, *args, **kwargs)
+
+    def render():
+        request = get_request_fixture()
+        c = RequestContext(request)
+        PageAssembly('planapp/page/full.yaml', c).dumps()
+
+    image = resolver.get_filepath('planapp/page/media/img/uses1.gif')
+    image_dir = os.path.dirname(image)
+
+    sync.sync_directory = counting_sync
+    try:
+        render()
+        assert image_dir in synced
+
+        # Without a watcher we trust the files not to change outside of DEBUG
+        settings.DEBUG = False
+        del synced[:]
+        render()
+        assert image_dir not in synced
+
+        settings.SKYLARK_MEDIA_WATCHER = 'poll'
+        settings.SKYLARK_MEDIA_WATCHER_INTERVAL = 0.1
+        settings.DEBUG = True
+
+        render()
+        del synced[:]
+        render()
+        assert image_dir not in synced
+
+        mtime = os.stat(image).st_mtime + 10
+        os.utime(image, (mtime, mtime))
+        get_watcher().poll()
+
+        render()
+        assert image_dir in synced
+    finally:
+        sync.sync_directory = sync_directory
+        settings.SKYLARK_MEDIA_WATCHER = None
+
+
+@with_setup(setup, teardown)
+def test_publish_referenced_images():
+    settings.SKYLARK_PLANS = 'mediadeploy_fewest'
+    plan_options(publish_referenced_images=True)
+
+    request = get_request_fixture()
+    c = RequestContext(request)
+    content = PageAssembly('planapp/page/full.yaml', c).dumps()
+
+    # static_uses1.css points at uses1.gif, nothing uses uses2.gif
+    exist('out/planapp/page/media/img/uses1.gif')
+    assert not os.path.exists(os.path.join(cachedir, 'out', 'planapp',
+        'page', 'media', 'img', 'uses2.gif'))
+
+    # Once it's there it's left alone
+    pi = PageInstructions()
+    pi.css = [{'static': 'planapp/page/media/css/static_uses1.css'}]
+    assert FewestFiles(c, True)._prepare_referenced_images(pi) == []
+
+    teardown()
+    assert FewestFiles(c, True)._prepare_referenced_images(pi) == [
+        'planapp/page/media/img/uses1.gif']
+
+
+@with_setup(setup_template_copy, teardown_template_copy)
+def test_inline_images_under():
+    from skylark import resolver
+    from skylark.plans import base
+    from skylark.watcher import get_watcher
+
+    settings.SKYLARK_PLANS = 'mediadeploy_fewest'
+    plan_options(inline_images_under=1024)
+
+    image = resolver.get_filepath('planapp/page/media/img/uses1.gif')
+    image_source = get_contents(image)
+    uses1 = 'url(data:image/gif;base64,%s)' % (
+        'R0lGODlhAQABAIAAAP///////yH5BAEKAAEALAAAAAABAAEAAAICTAEAOw==')
+
+    encoded = []
+
+    def counting_encode_data_uri(source, mimetype):
+        encoded.append(mimetype)
+        return encode_data_uri(source, mimetype)
+
+    def render():
+        c = RequestContext(get_request_fixture())
+        content = PageAssembly('planapp/page/full.yaml', c).dumps()
+        match = re.search(r'cfcache/(out/[0-9a-f]{32}\.css)', content)
+        return get_contents(os.path.join(cachedir, match.group(1)))
+
+    encode_data_uri = base.encode_data_uri
+    base.encode_data_uri = counting_encode_data_uri
+    try:
+        css_file = render()
+        assert uses1 in css_file
+        assert 'uses1.gif' not in css_file
+        assert encoded == ['image/gif']
+
+        # Building the rollup again uses the image we already encoded
+        teardown()
+        assert uses1 in render()
+        assert encoded == ['image/gif']
+
+        # Changing the image changes the rollup, even though none of the CSS
+        # has changed
+        def change_image(last_byte, mtime):
+            f = open(image, 'wb')
+            try:
+                f.write(image_source[:-1] + last_byte)
+            finally:
+                f.close()
+            os.utime(image, (mtime, mtime))
+
+        mtime = os.stat(image).st_mtime
+        change_image('\x3c', mtime + 10)
+        assert 'url(data:image/gif;base64,%s)' % (
+            'R0lGODlhAQABAIAAAP///////yH5BAEKAAEALAAAAAABAAEAAAICTAEAPA==') in \
+            render()
+        assert encoded == ['image/gif', 'image/gif']
+
+        # Another process goes by the record of the last rollup built
+        FewestFiles(RequestContext(get_request_fixture()),
+            True).state.rollup_basenames.clear()
+        change_image('\x3d', mtime + 20)
+        assert 'url(data:image/gif;base64,%s)' % (
+            'R0lGODlhAQABAIAAAP///////yH5BAEKAAEALAAAAAABAAEAAAICTAEAPQ==') in \
+            render()
+
+        # The watcher keeps an eye on the images as well
+        settings.SKYLARK_MEDIA_WATCHER = 'poll'
+        render()
+        render()
+        change_image('\x3e', mtime + 30)
+        get_watcher().poll()
+        assert 'url(data:image/gif;base64,%s)' % (
+            'R0lGODlhAQABAIAAAP///////yH5BAEKAAEALAAAAAABAAEAAAICTAEAPg==') in \
+            render()
+    finally:
+        settings.SKYLARK_MEDIA_WATCHER = None
+        base.encode_data_uri = encode_data_uri
+
+    # Turned off the urls point at the cache again
+    plan_options(inline_images_under=0)
+    css_file = render()
+    assert 'out/planapp/page/media/img/uses1.gif' in css_file
+
+
 @with_setup(setup, teardown)
 def test_will_rollup_with_lessjs():
     settings.SKYLARK_PLANS = 'mediadeploy_reusable'
@@ -286,7 +741,7 @@ def test_will_rollup_with_lessjs():
 
     settings.SKYLARK_PLANS = 'mediadeploy_fewest'
 
-    hash_css = '8015602c1f5583386d62d1478e2a8442'
+    hash_css = 'a3257b44a1067149afd4486cbd6ba978'
     filename = os.path.join(cachedir, 'out', '%s.css' % hash_css)
 
     request = get_request_fixture()
@@ -303,3 +758,148 @@ def test_will_rollup_with_lessjs():
 
     assert '@less' in css_file
     assert 'cfcache/out/planapp/page/media/img/header.png' in css_file
+
+
+@with_setup(setup, teardown)
+def test_build_manifest():
+    from tempfile import mkdtemp
+    from skylark import build
+
+    settings.SKYLARK_PLANS = 'mediadeploy_fewest'
+
+    tmpdir = mkdtemp()
+    manifest = os.path.join(tmpdir, 'manifest.json')
+    original_manifest = settings.SKYLARK_BUILD_MANIFEST
+    settings.SKYLARK_BUILD_MANIFEST = manifest
+
+    try:
+        errors = build.build_manifest(['planapp/page/full.yaml'])
+        assert not errors
+
+        # The request path should not need anything from the cache directory
+        shutil.rmtree(os.path.join(cachedir, 'out'))
+        settings.SKYLARK_USE_BUILD_MANIFEST = True
+
+        request = get_request_fixture()
+        c = RequestContext(request)
+        pa = PageAssembly('planapp/page/full.yaml', c)
+
+        content = pa.dumps()
+
+        assert not os.path.isdir(os.path.join(cachedir, 'out'))
+        assert '26095485f48d5b031c0cf984ce5dbde3.css' in content
+        assert '6c087fac6caa186ba5fabf171eecf520.js' in content
+        assert 'media/uses1.js' in content
+    finally:
+        settings.SKYLARK_BUILD_MANIFEST = original_manifest
+        build.clear_manifest()
+        shutil.rmtree(tmpdir)
+
+
+@with_setup(setup, teardown)
+def test_build_manifest_in_parallel():
+    import json
+    from tempfile import mkdtemp
+    from skylark import build
+
+    settings.SKYLARK_PLANS = 'mediadeploy_fewest'
+
+    entry_points = ['planapp/page/full.yaml', 'planapp/page/uses1.yaml',
+        'planapp/page/full_missing.yaml', 'planapp/page/uses2.yaml']
+
+    tmpdir = mkdtemp()
+    try:
+        serial = os.path.join(tmpdir, 'serial.json')
+        serial_errors = build.build_manifest(entry_points, serial)
+
+        teardown()
+
+        parallel = os.path.join(tmpdir, 'parallel.json')
+        parallel_errors = build.build_manifest(entry_points, parallel,
+            jobs=3)
+
+        assert json.load(open(serial)) == json.load(open(parallel))
+        assert [i[0] for i in parallel_errors] == \
+            ['planapp/page/full_missing.yaml']
+        assert isinstance(parallel_errors[0][1], TemplateDoesNotExist)
+        assert [i[0] for i in serial_errors] == \
+            [i[0] for i in parallel_errors]
+
+        # The workers built the rollups for us
+        assert os.path.isfile(os.path.join(cachedir, 'out',
+            '6c087fac6caa186ba5fabf171eecf520.js'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@with_setup(setup, teardown)
+def test_build_warm_up():
+    from tempfile import mkdtemp
+    from django.core.management import call_command
+    from skylark.utils import mediacache
+
+    settings.SKYLARK_PLANS = 'mediadeploy_fewest'
+    mediacache.clear_media_cache()
+
+    tmpdir = mkdtemp()
+    manifest = os.path.join(tmpdir, 'manifest.json')
+    original_manifest = settings.SKYLARK_BUILD_MANIFEST
+    settings.SKYLARK_BUILD_MANIFEST = manifest
+
+    try:
+        call_command('skylark_build', 'planapp/page/full.yaml',
+            warm_up=True, jobs=1)
+
+        # The rollups are there and the processed CSS is in the media cache
+        exist('out/26095485f48d5b031c0cf984ce5dbde3.css',
+            'out/6c087fac6caa186ba5fabf171eecf520.js')
+        assert mediacache.get_media_cache().bytes > 0
+
+        # But there's no manifest
+        assert not os.path.exists(manifest)
+    finally:
+        settings.SKYLARK_BUILD_MANIFEST = original_manifest
+        shutil.rmtree(tmpdir)
+
+
+@with_setup(setup, teardown)
+def test_fingerprint_static():
+    from skylark.utils import publish
+    from skylark.views.media import serve
+
+    plan_options(fingerprint_static=True)
+
+    request = get_request_fixture()
+    c = RequestContext(request)
+    pa = PageAssembly('dummyapp/page/sample.yaml', c)
+
+    content = pa.dumps()
+
+    match = re.search(r'cfcache/(out/dummyapp/page/media/js/sample\.'
+        '[0-9a-f]{12}\.js)', content)
+    assert match
+    assert 'media/js/sample.js' not in content
+    exist(match.group(1))
+
+    response = serve(get_request_fixture(), match.group(1))
+    assert response['Cache-Control'] == 'public, max-age=31536000'
+
+    response = serve(get_request_fixture(),
+        'out/dummyapp/page/media/img/test.png')
+    assert not response.has_header('Cache-Control')
+
+    # Rollups are named by their content too
+    settings.SKYLARK_PLANS = 'mediadeploy_fewest'
+    content = PageAssembly('planapp/page/full.yaml',
+        RequestContext(get_request_fixture())).dumps()
+    match = re.search(r'cfcache/(out/[0-9a-f]{32}\.css)', content)
+    response = serve(get_request_fixture(), match.group(1))
+    assert response['Cache-Control'] == 'public, max-age=31536000'
+
+    # Names that only look like they have a digest in them
+    for name in ('out/plain.0123456789ab.js',
+                 'out/0123456789abcdef0123456789abcdef.js'):
+        publish.write_file(os.path.join(cachedir, name), 'var a = 1;')
+        response = serve(get_request_fixture(), name)
+        assert response.status_code == 200
+        assert not response.has_header('Cache-Control')
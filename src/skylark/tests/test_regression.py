@@ -135,7 +135,7 @@ def test_bb_issue_25():
     # TODO Need to still write a test for block comments
     settings.SKYLARK_PLANS = 'mediadeploy_reusable'
 
-    hash_js = 'bbc01a8493372bb2e9127837ed42dfab'
+    hash_js = '5f71eaea39719b366691a126472eeca8'
 
     request = get_request_fixture()
     c = RequestContext(request, {})
@@ -0,0 +1,46 @@
+import py.test
+import os
+import shutil
+import tempfile
+
+from django.template import TemplateDoesNotExist
+from django.template.loaders import app_directories
+
+from skylark import resolver
+from skylark.tests import *
+
+
+def test_index_agrees_with_loaders():
+    for name in ('planapp/page/full.yaml',
+                 'planapp/page/media/js/static.js',
+                 'chirp/tools.yaml',):
+        source, filepath = \
+            app_directories._loader.load_template_source(name)
+        assert resolver.get_filepath(name) == filepath
+        assert resolver.load_source(name) == (source, filepath)
+
+
+def test_finds_files_added_and_removed_after_indexing():
+    template_dir = tempfile.mkdtemp()
+    template_dirs = settings.TEMPLATE_DIRS
+    settings.TEMPLATE_DIRS = (template_dir,) + tuple(template_dirs)
+    try:
+        resolver.invalidate()
+        resolver.get_index()
+
+        filename = os.path.join(template_dir, 'added.js')
+        f = open(filename, 'w')
+        f.write('var added;')
+        f.close()
+
+        assert resolver.load_source('added.js') == (u'var added;', filename)
+
+        os.remove(filename)
+
+        py.test.raises(TemplateDoesNotExist, resolver.load_source,
+            'added.js')
+        py.test.raises(TemplateDoesNotExist, resolver.stat, 'added.js')
+    finally:
+        settings.TEMPLATE_DIRS = template_dirs
+        resolver.invalidate()
+        shutil.rmtree(template_dir)
@@ -0,0 +1,216 @@
+import py.test
+import os
+import shutil
+import tempfile
+from time import sleep
+
+from skylark.tests import *
+from skylark.utils import jsmin
+from skylark.tests.reference import jsmin as jsmin_reference
+from skylark.utils import mediacache
+from skylark.utils import sync
+from skylark.utils.lock import FileLock
+from skylark.utils import yamlloader
+from skylark.utils.lru import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    # Touch a, this makes b the oldest
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+    assert cache.keys() == ['a', 'c']
+
+
+def test_yaml_load_is_safe():
+    from yaml.constructor import ConstructorError
+
+    py.test.raises(ConstructorError, yamlloader.load,
+        'foo: !!python/object/apply:os.getcwd []')
+
+
+def test_yaml_load_gives_copies():
+    yamlloader.clear_document_cache()
+
+    first = yamlloader.load('js:\n    - static: foo.js\n')
+    first['js'][0]['sourcefile'] = 'foo.yaml'
+
+    second = yamlloader.load('js:\n    - static: foo.js\n')
+    assert second == {'js': [{'static': 'foo.js'}]}
+
+
+def test_sync_copies_only_what_changed():
+    def write(filename, content):
+        f = open(filename, 'w')
+        f.write(content)
+        f.close()
+
+    root = tempfile.mkdtemp()
+    try:
+        source = os.path.join(root, 'source')
+        destination = os.path.join(root, 'destination')
+        manifest = os.path.join(root, 'manifest.json')
+        os.makedirs(os.path.join(source, 'sprites'))
+        write(os.path.join(source, 'header.png'), 'header')
+        write(os.path.join(source, 'sprites', 'icons.png'), 'icons')
+
+        report = sync.sync_directory(source, destination, manifest)
+        assert sorted(report.added) == ['header.png', 'sprites/icons.png']
+        assert report.changed
+
+        report = sync.sync_directory(source, destination, manifest)
+        assert sorted(report.unchanged) == ['header.png', 'sprites/icons.png']
+        assert not report.changed
+
+        sleep(0.01)
+        write(os.path.join(source, 'header.png'), 'a new header')
+        os.remove(os.path.join(source, 'sprites', 'icons.png'))
+        write(os.path.join(source, 'footer.png'), 'footer')
+
+        report = sync.sync_directory(source, destination, manifest)
+        assert report.updated == ['header.png']
+        assert report.removed == ['sprites/icons.png']
+        assert report.added == ['footer.png']
+
+        assert get_contents(os.path.join(destination, 'header.png')) == \
+            'a new header'
+        assert sorted(os.listdir(destination)) == ['footer.png', 'header.png']
+
+        # Touching a file without changing it doesn't copy it
+        os.utime(os.path.join(source, 'footer.png'), (0, 0))
+        report = sync.sync_directory(source, destination, manifest)
+        assert not report.changed
+    finally:
+        shutil.rmtree(root)
+
+
+def test_file_lock_keeps_other_processes_out():
+    root = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(root, 'rollup.js.lock')
+        lock = FileLock(filename)
+        assert lock.acquire()
+
+        pid = os.fork()
+        if pid == 0:
+            # In the child, we shouldn't be able to get it
+            got_it = FileLock(filename).acquire(blocking=False)
+            os._exit(got_it and 1 or 0)
+        assert os.waitpid(pid, 0)[1] == 0
+
+        assert not FileLock(filename).acquire(blocking=False)
+
+        lock.release()
+
+        other = FileLock(filename)
+        assert other.acquire(blocking=False)
+        other.release()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_media_cache_backends():
+    key = mediacache.make_key('app/screen.css', None, u'a { }')
+    assert key != mediacache.make_key('app/screen.css', None, u'b { }')
+
+    root = tempfile.mkdtemp()
+    try:
+        for cache in (mediacache.LocMemMediaCache(),
+                      mediacache.DiskMediaCache(root),):
+            assert cache.get(key) is None
+            cache.set(key, u'a { color: \u00e9; }')
+            assert cache.get(key) == u'a { color: \u00e9; }'
+            cache.set(key, u'')
+            assert cache.get(key) == u''
+            cache.clear()
+            assert cache.get(key) is None
+    finally:
+        shutil.rmtree(root)
+
+    cache = mediacache.LocMemMediaCache(max_entries=10, max_bytes=10)
+    cache.set('a', 'aaaaa')
+    cache.set('b', 'bbbbb')
+    assert cache.bytes == 10
+    cache.set('c', 'ccccc')
+    assert cache.get('a') is None
+    assert cache.get('c') == 'ccccc'
+    assert cache.bytes == 10
+
+    # Sizes are in bytes, not characters
+    cache = mediacache.LocMemMediaCache(max_entries=10, max_bytes=10)
+    cache.set('a', u'\u00e9\u00e9\u00e9')
+    assert cache.bytes == 6
+    cache.set('b', u'\u00e9\u00e9\u00e9')
+    assert cache.get('a') is None
+    assert cache.bytes == 6
+
+
+def test_disk_media_cache_is_bounded():
+    py.test.raises(ValueError, mediacache.DiskMediaCache, None)
+
+    root = tempfile.mkdtemp()
+    try:
+        cache = mediacache.DiskMediaCache(root, max_bytes=10)
+        cache.set('aa', 'aaaaa')
+        cache.set('bb', 'bbbbb')
+        os.utime(cache._filename('aa'), (1000, 1000))
+        os.utime(cache._filename('bb'), (2000, 2000))
+
+        cache.set('cc', 'ccccc')
+        assert cache.get('aa') is None
+        assert cache.get('bb') == 'bbbbb'
+        assert cache.get('cc') == 'ccccc'
+    finally:
+        shutil.rmtree(root)
+
+    root = tempfile.mkdtemp()
+    try:
+        # Five characters but ten bytes each, twenty bytes written is more
+        # than a tenth of max_bytes so it's time to look at what's there
+        cache = mediacache.DiskMediaCache(root, max_bytes=150)
+        pruned = []
+        cache.prune = lambda: pruned.append(True)
+        cache.set('aa', u'\u00e9' * 5)
+        assert not pruned
+        cache.set('bb', u'\u00e9' * 5)
+        assert pruned
+    finally:
+        shutil.rmtree(root)
+
+
+def test_jsmin_agrees_with_reference():
+    mediadir = os.path.join(os.path.dirname(projectdir), 'templates',
+        'chirp', 'media')
+    sources = [
+        u'',
+        u'var a = 1;\r\nvar b = "two";\r\n',
+        u'/* comment */ a = b // another\n+ +c - -d;',
+        u'x = /[/]+\\//g.test(y); z = a / b / c;',
+        u'return /re/.exec(s)\n/x/',
+        u"s = 'it\\'s' + \"\\\"q\\\"\";\n\n\n  }\n]\n)",
+        u'if (a)\t{\x0b\x0cb();\x01}',
+        u'var caf\xe9 = "\u2603";\nfoo\n(bar)',
+        u'a = 1; /* never ends',
+        u'a = "never ends',
+        u'a = (/never ends',
+    ]
+    for name in ('tools/base.js', 'tools/Parser.js', 'dojo/string.js',
+                 'dojo/regexp.js', 'dojo/date.js',):
+        sources.append(open(os.path.join(mediadir, name)).read())
+
+    for source in sources:
+        try:
+            expected = jsmin_reference.jsmin(source)
+        except Exception, e:
+            py.test.raises(getattr(jsmin, e.__class__.__name__), jsmin.jsmin,
+                source)
+        else:
+            assert jsmin.jsmin(source) == expected
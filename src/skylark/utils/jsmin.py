@@ -1,218 +1,232 @@
-#!/usr/bin/python
-
-# This code is original from jsmin by Douglas Crockford, it was translated to
-# Python by Baruch Even. The original code had the following copyright and
-# license.
-#
-# /* jsmin.c
-#    2007-05-22
-#
-# Copyright (c) 2002 Douglas Crockford  (www.crockford.com)
-#
-# Permission is hereby granted, free of charge, to any person obtaining a copy of
-# this software and associated documentation files (the "Software"), to deal in
-# the Software without restriction, including without limitation the rights to
-# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
-# of the Software, and to permit persons to whom the Software is furnished to do
-# so, subject to the following conditions:
-#
-# The above copyright notice and this permission notice shall be included in all
-# copies or substantial portions of the Software.
-#
-# The Software shall be used for Good, not Evil.
-#
-# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
-# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
-# SOFTWARE.
-# */
-
-from StringIO import StringIO
-
-def jsmin(js):
-    ins = StringIO(js)
-    outs = StringIO()
-    JavascriptMinify().minify(ins, outs)
-    str = outs.getvalue()
-    if len(str) > 0 and str[0] == '\n':
-        str = str[1:]
-    return str
-
-def isAlphanum(c):
-    """return true if the character is a letter, digit, underscore,
-           dollar sign, or non-ASCII character.
-    """
-    return ((c >= 'a' and c <= 'z') or (c >= '0' and c <= '9') or
-            (c >= 'A' and c <= 'Z') or c == '_' or c == '$' or c == '\\' or (c is not None and ord(c) > 126));
-
-class UnterminatedComment(Exception):
-    pass
-
-class UnterminatedStringLiteral(Exception):
-    pass
-
-class UnterminatedRegularExpression(Exception):
-    pass
-
-class JavascriptMinify(object):
-
-    def _outA(self):
-        self.outstream.write(self.theA)
-    def _outB(self):
-        self.outstream.write(self.theB)
-
-    def _get(self):
-        """return the next character from stdin. Watch out for lookahead. If
-           the character is a control character, translate it to a space or
-           linefeed.
-        """
-        c = self.theLookahead
-        self.theLookahead = None
-        if c == None:
-            c = self.instream.read(1)
-        if c >= ' ' or c == '\n':
-            return c
-        if c == '': # EOF
-            return '\000'
-        if c == '\r':
-            return '\n'
-        return ' '
-
-    def _peek(self):
-        self.theLookahead = self._get()
-        return self.theLookahead
-
-    def _next(self):
-        """get the next character, excluding comments. peek() is used to see
-           if an unescaped '/' is followed by a '/' or '*'.
-        """
-        c = self._get()
-        if c == '/' and self.theA != '\\':
-            p = self._peek()
-            if p == '/':
-                c = self._get()
-                while c > '\n':
-                    c = self._get()
-                return c
-            if p == '*':
-                c = self._get()
-                while 1:
-                    c = self._get()
-                    if c == '*':
-                        if self._peek() == '/':
-                            self._get()
-                            return ' '
-                    if c == '\000':
-                        raise UnterminatedComment()
-
-        return c
-
-    def _action(self, action):
-        """do something! What you do is determined by the argument:
-           1   Output A. Copy B to A. Get the next B.
-           2   Copy B to A. Get the next B. (Delete A).
-           3   Get the next B. (Delete B).
-           action treats a string as a single character. Wow!
-           action recognizes a regular expression if it is preceded by ( or , or =.
-        """
-        if action <= 1:
-            self._outA()
-
-        if action <= 2:
-            self.theA = self.theB
-            if self.theA == "'" or self.theA == '"':
-                while 1:
-                    self._outA()
-                    self.theA = self._get()
-                    if self.theA == self.theB:
-                        break
-                    if self.theA <= '\n':
-                        raise UnterminatedStringLiteral()
-                    if self.theA == '\\':
-                        self._outA()
-                        self.theA = self._get()
-
-
-        if action <= 3:
-            self.theB = self._next()
-            if self.theB == '/' and (self.theA == '(' or self.theA == ',' or
-                                     self.theA == '=' or self.theA == ':' or
-                                     self.theA == '[' or self.theA == '?' or
-                                     self.theA == '!' or self.theA == '&' or
-                                     self.theA == '|' or self.theA == ';' or
-                                     self.theA == '{' or self.theA == '}' or
-                                     self.theA == '\n'):
-                self._outA()
-                self._outB()
-                while 1:
-                    self.theA = self._get()
-                    if self.theA == '/':
-                        break
-                    elif self.theA == '\\':
-                        self._outA()
-                        self.theA = self._get()
-                    elif self.theA <= '\n':
-                        raise UnterminatedRegularExpression()
-                    self._outA()
-                self.theB = self._next()
-
-
-    def _jsmin(self):
-        """Copy the input to the output, deleting the characters which are
-           insignificant to JavaScript. Comments will be removed. Tabs will be
-           replaced with spaces. Carriage returns will be replaced with linefeeds.
-           Most spaces and linefeeds will be removed.
-        """
-        self.theA = '\n'
-        self._action(3)
-
-        while self.theA != '\000':
-            if self.theA == ' ':
-                if isAlphanum(self.theB):
-                    self._action(1)
-                else:
-                    self._action(2)
-            elif self.theA == '\n':
-                if self.theB in ['{', '[', '(', '+', '-']:
-                    self._action(1)
-                elif self.theB == ' ':
-                    self._action(3)
-                else:
-                    if isAlphanum(self.theB):
-                        self._action(1)
-                    else:
-                        self._action(2)
-            else:
-                if self.theB == ' ':
-                    if isAlphanum(self.theA):
-                        self._action(1)
-                    else:
-                        self._action(3)
-                elif self.theB == '\n':
-                    if self.theA in ['}', ']', ')', '+', '-', '"', '\'']:
-                        self._action(1)
-                    else:
-                        if isAlphanum(self.theA):
-                            self._action(1)
-                        else:
-                            self._action(3)
-                else:
-                    self._action(1)
-
-    def minify(self, instream, outstream):
-        self.instream = instream
-        self.outstream = outstream
-        self.theA = '\n'
-        self.theB = None
-        self.theLookahead = None
-
-        self._jsmin()
-        self.instream.close()
-
-if __name__ == '__main__':
-    import sys
-    jsm = JavascriptMinify()
-    jsm.minify(sys.stdin, sys.stdout)
+#!/usr/bin/python
+
+# This code is original from jsmin by Douglas Crockford, it was translated to
+# Python by Baruch Even. The original code had the following copyright and
+# license.
+#
+# /* jsmin.c
+#    2007-05-22
+#
+# Copyright (c) 2002 Douglas Crockford  (www.crockford.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# The Software shall be used for Good, not Evil.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# */
+
+import re
+
+def jsmin(js):
+    """Minifies js, this gives back exactly what the original JavascriptMinify
+       did but works on the whole string at once instead of a character at a
+       time.
+    """
+    str = _minify(js)
+    if len(str) > 0 and str[0] == '\n':
+        str = str[1:]
+    return str
+
+class UnterminatedComment(Exception):
+    pass
+
+class UnterminatedStringLiteral(Exception):
+    pass
+
+class UnterminatedRegularExpression(Exception):
+    pass
+
+# What follows is the same state machine as the JavascriptMinify class of the
+# original translation (see skylark.tests.reference.jsmin).  The difference is
+# that it works on a string with the control characters already translated
+# and that it handles whole runs of characters (identifiers, whitespace,
+# comments, strings, and regular expressions) with one regular expression or
+# find instead of one method call per character.
+
+_control_characters = re.compile(r'[\x00-\x09\x0b\x0c\x0e-\x1f]')
+
+# Characters that always get action 1 when they follow each other
+_plain_run = re.compile(r'[^ \n\'"/]*')
+_spaces = re.compile(r' *')
+_whitespace = re.compile(r'[ \n]*')
+_string_runs = {
+    "'": re.compile(r"[^'\\\n]*"),
+    '"': re.compile(r'[^"\\\n]*'),
+}
+_regex_run = re.compile(r'[^/\\\n]*')
+
+_alphanum = frozenset('abcdefghijklmnopqrstuvwxyz0123456789'
+                      'ABCDEFGHIJKLMNOPQRSTUVWXYZ_$\\')
+_regex_preceders = frozenset('(,=:[?!&|;{}\n')
+_newline_before = frozenset('{[(+-')
+_newline_after = frozenset('}])+-"\'')
+
+def _is_alphanum(c):
+    return c in _alphanum or c > '~'
+
+def _next(text, pos, n, a):
+    """get the next character, excluding comments, starting at pos.  Gives
+       back the character and the position after it.
+    """
+    if pos >= n:
+        return '\000', pos
+    c = text[pos]
+    pos += 1
+    if c == '/' and a != '\\' and pos < n:
+        p = text[pos]
+        if p == '/':
+            end = text.find('\n', pos)
+            if end == -1:
+                return '\000', n
+            return '\n', end + 1
+        if p == '*':
+            end = text.find('*/', pos + 1)
+            if end == -1:
+                raise UnterminatedComment()
+            return ' ', end + 2
+    return c, pos
+
+def _minify(js):
+    text = _control_characters.sub(' ', js.replace('\r', '\n'))
+    n = len(text)
+    out = []
+    write = out.append
+
+    a = '\n'
+    b, pos = _next(text, 0, n, a)
+    if b == '/' and a in _regex_preceders:
+        a, b, pos = _regex(text, pos, n, a, b, write)
+
+    while a != '\000':
+        """Work out which action JavascriptMinify._jsmin would take, skipping
+           ahead where we know it would take the same one many times in a row
+        """
+        if a == ' ':
+            if b == ' ':
+                # Action 2 until we are past the spaces
+                pos = _spaces.match(text, pos).end()
+                b, pos = _next(text, pos, n, a)
+                continue
+            action = _is_alphanum(b) and 1 or 2
+        elif a == '\n':
+            if b in _newline_before:
+                action = 1
+            elif b == ' ' or b == '\n':
+                # Action 2 or 3 until we are past the whitespace, either way a
+                # stays a newline
+                pos = _whitespace.match(text, pos).end()
+                action = 3
+            else:
+                action = _is_alphanum(b) and 1 or 2
+        else:
+            if b == ' ':
+                if _is_alphanum(a):
+                    action = 1
+                else:
+                    pos = _spaces.match(text, pos).end()
+                    action = 3
+            elif b == '\n':
+                if a in _newline_after or _is_alphanum(a):
+                    action = 1
+                else:
+                    action = 3
+            else:
+                if b not in '\'"/\000':
+                    # A run of characters that will all be written out as is
+                    end = _plain_run.match(text, pos).end()
+                    if end > pos:
+                        write(a)
+                        write(text[pos - 1:end - 1])
+                        a = text[end - 1]
+                        b, pos = _next(text, end, n, a)
+                        if b == '/' and a in _regex_preceders:
+                            a, b, pos = _regex(text, pos, n, a, b, write)
+                        continue
+                action = 1
+
+        if action <= 1:
+            write(a)
+
+        if action <= 2:
+            a = b
+            if a == "'" or a == '"':
+                pos = _string(text, pos, n, a, write)
+
+        b, pos = _next(text, pos, n, a)
+        if b == '/' and a in _regex_preceders:
+            a, b, pos = _regex(text, pos, n, a, b, write)
+
+    return ''.join(out)
+
+def _string(text, pos, n, quote, write):
+    """Writes out the string literal that starts with quote, up to but not
+       including the closing quote.  Gives back the position after it.
+    """
+    write(quote)
+    run = _string_runs[quote]
+    while 1:
+        end = run.match(text, pos).end()
+        write(text[pos:end])
+        pos = end
+        if pos >= n:
+            raise UnterminatedStringLiteral()
+        c = text[pos]
+        pos += 1
+        if c == quote:
+            return pos
+        if c == '\n':
+            raise UnterminatedStringLiteral()
+        # A backslash, and whatever it escapes
+        write(c)
+        if pos >= n:
+            raise UnterminatedStringLiteral()
+        write(text[pos])
+        pos += 1
+
+def _regex(text, pos, n, a, b, write):
+    """Writes out a and the regular expression literal that starts with b,
+       giving back the new a, b, and position
+    """
+    write(a)
+    write(b)
+    while 1:
+        end = _regex_run.match(text, pos).end()
+        write(text[pos:end])
+        pos = end
+        if pos >= n:
+            raise UnterminatedRegularExpression()
+        c = text[pos]
+        pos += 1
+        if c == '/':
+            break
+        if c == '\n':
+            raise UnterminatedRegularExpression()
+        # A backslash, and whatever it escapes
+        write(c)
+        if pos < n:
+            write(text[pos])
+            pos += 1
+        else:
+            write('\000')
+    a = '/'
+    b, pos = _next(text, pos, n, a)
+    return a, b, pos
+
+if __name__ == '__main__':
+    import sys
+    sys.stdout.write(jsmin(sys.stdin.read()))
@@ -0,0 +1,101 @@
+"""
+Locks that work across processes, so only one of the workers serving a site
+builds a given file at a time.
+
+These use fcntl.flock on a lock file next to whatever is being built.  On
+platforms without fcntl they don't lock anything.
+"""
+import os
+import errno
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock(object):
+    """
+    An exclusive lock on filename, which is created if it does not exist::
+
+        lock = FileLock('/var/cache/skylark/out/abc.js.lock')
+        if lock.acquire(blocking=False):
+            try:
+                ...
+            finally:
+                lock.release()
+
+    flock locks belong to the open file, so threads in one process are kept
+    apart with a regular lock as well.
+    """
+    __thread_locks = {}
+    __thread_locks_lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.__file = None
+
+        FileLock.__thread_locks_lock.acquire()
+        try:
+            self.__thread_lock = FileLock.__thread_locks.setdefault(
+                self.filename, threading.Lock())
+        finally:
+            FileLock.__thread_locks_lock.release()
+
+    def acquire(self, blocking=True):
+        """
+        Gives back True if we got the lock, which is always the case if
+        blocking is True
+        """
+        if not self.__thread_lock.acquire(blocking):
+            return False
+
+        if fcntl is None:
+            return True
+
+        try:
+            dirname = os.path.dirname(self.filename)
+            if not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+            self.__file = open(self.filename, 'a')
+
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(self.__file.fileno(), flags)
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                self.__file.close()
+                self.__file = None
+                self.__thread_lock.release()
+                return False
+        except:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+            self.__thread_lock.release()
+            raise
+
+        return True
+
+    def release(self):
+        if self.__file is not None:
+            fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+            self.__file.close()
+            self.__file = None
+        self.__thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
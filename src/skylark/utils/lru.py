@@ -0,0 +1,111 @@
+"""
+A small, thread safe least recently used cache.
+"""
+from threading import RLock
+
+
+class LRUCache(object):
+    """
+    Dictionary-like object that holds on to at most max_entries items.  When
+    it fills up the item that was used the longest time ago gets thrown out.
+    """
+
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self.__lock = RLock()
+        self.clear()
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            self.__map = {}
+            # Circular doubly linked list of [prev, next, key, value], root is
+            # a sentinel.  The most recently used link is root[0].
+            self.__root = root = []
+            root[:] = [root, root, None, None]
+        finally:
+            self.__lock.release()
+
+    def __len__(self):
+        return len(self.__map)
+
+    def __contains__(self, key):
+        return key in self.__map
+
+    def __unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def __link_last(self, link):
+        root = self.__root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+    def get(self, key, default=None):
+        self.__lock.acquire()
+        try:
+            link = self.__map.get(key)
+            if link is None:
+                return default
+            # Move it to the most recently used spot
+            self.__unlink(link)
+            self.__link_last(link)
+            return link[3]
+        finally:
+            self.__lock.release()
+
+    def set(self, key, value):
+        self.__lock.acquire()
+        try:
+            if key in self.__map:
+                link = self.__map[key]
+                link[3] = value
+                self.__unlink(link)
+                self.__link_last(link)
+                return
+
+            link = [None, None, key, value]
+            self.__link_last(link)
+            self.__map[key] = link
+
+            while len(self.__map) > self.max_entries:
+                self.__evict()
+        finally:
+            self.__lock.release()
+
+    def delete(self, key):
+        self.__lock.acquire()
+        try:
+            link = self.__map.pop(key, None)
+            if link is not None:
+                self.__unlink(link)
+        finally:
+            self.__lock.release()
+
+    def __evict(self):
+        oldest = self.__root[1]
+        self.__unlink(oldest)
+        del self.__map[oldest[2]]
+        self.evicted(oldest[2], oldest[3])
+
+    def evicted(self, key, value):
+        """
+        Called when an item is thrown out of the cache, subclasses can use this
+        to keep track of what they are holding on to
+        """
+        pass
+
+    def keys(self):
+        self.__lock.acquire()
+        try:
+            keys = []
+            link = self.__root[1]
+            while link is not self.__root:
+                keys.append(link[2])
+                link = link[1]
+            return keys
+        finally:
+            self.__lock.release()
@@ -0,0 +1,273 @@
+"""
+Holds on to media after it has been processed (CleverCSS for example) so we
+only have to do that once.
+
+Entries are keyed by the template name of the file, the function that
+processed it, and a digest of the source.  If the file changes so does the key,
+so there is nothing to invalidate and it's safe to use while DEBUG is on.  The
+key doesn't depend on where the templates are, so servers that deploy to
+different paths can share entries.
+
+Where the entries are kept is up to SKYLARK_MEDIA_CACHE:
+
+    locmem      In this process, bounded by SKYLARK_MEDIA_CACHE_MAX_ENTRIES and
+                SKYLARK_MEDIA_CACHE_MAX_BYTES
+    disk        Files in SKYLARK_MEDIA_CACHE_DIRECTORY, bounded by
+                SKYLARK_MEDIA_CACHE_DISK_MAX_BYTES.  Every process that uses
+                the directory shares them.
+    django      Django's cache framework (CACHE_BACKEND), with memcached every
+                server shares them
+
+It can also be the dotted path to a class of your own that has get, set, and
+clear methods.
+"""
+import os
+import errno
+import hashlib
+import threading
+
+from django.utils.importlib import import_module
+
+from skylark.conf import settings
+from skylark.utils import publish
+from skylark.utils.lru import LRUCache
+
+__media_cache = None
+
+
+def make_key(template_name, process_func, source):
+    """
+    A key for the processed source of template_name that is the same in every
+    process and on every server
+    """
+    if process_func is None:
+        processor = ''
+    else:
+        processor = '%s.%s' % (process_func.__module__,
+            process_func.__name__)
+
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    if isinstance(template_name, unicode):
+        template_name = template_name.encode('utf-8')
+
+    return hashlib.md5('%s\0%s\0%s' % (template_name, processor,
+        hashlib.md5(source).hexdigest())).hexdigest()
+
+
+def get_size(source):
+    """
+    How many bytes source takes up once it's encoded, unicode is stored as
+    UTF-8
+    """
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    return len(source)
+
+
+class BaseMediaCache(object):
+    def get(self, key):
+        """
+        The source stored for key, or None
+        """
+        raise NotImplementedError()
+
+    def set(self, key, source):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class LocMemMediaCache(BaseMediaCache):
+    """
+    Keeps entries in memory, throwing out the least recently used when there
+    are too many or they are too big
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries or \
+            settings.SKYLARK_MEDIA_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.SKYLARK_MEDIA_CACHE_MAX_BYTES
+        self.__lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            self.bytes = 0
+            self.__entries = _SizedLRUCache(self, self.max_entries)
+        finally:
+            self.__lock.release()
+
+    def get(self, key):
+        return self.__entries.get(key)
+
+    def set(self, key, source):
+        self.__lock.acquire()
+        try:
+            self.__entries.delete(key)
+            self.__entries.set(key, source)
+            self.bytes += get_size(source)
+
+            while self.bytes > self.max_bytes and len(self.__entries) > 1:
+                oldest = self.__entries.keys()[0]
+                self.__entries.delete(oldest)
+        finally:
+            self.__lock.release()
+
+    def forget(self, source):
+        self.bytes -= get_size(source)
+
+
+class _SizedLRUCache(LRUCache):
+    """
+    Tells the LocMemMediaCache whenever something leaves
+    """
+    def __init__(self, owner, max_entries):
+        self.owner = owner
+        LRUCache.__init__(self, max_entries)
+
+    def delete(self, key):
+        source = self.get(key)
+        if source is not None:
+            LRUCache.delete(self, key)
+            self.owner.forget(source)
+
+    def evicted(self, key, source):
+        self.owner.forget(source)
+
+
+class DiskMediaCache(BaseMediaCache):
+    """
+    One file per entry.  When the files add up to more than max_bytes the
+    ones written the longest time ago are removed.
+
+    The directory must not be somewhere your web server serves files from,
+    anybody who can write to it decides what goes in your pages.
+    """
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or settings.SKYLARK_MEDIA_CACHE_DIRECTORY
+        if not self.directory:
+            raise ValueError('Set SKYLARK_MEDIA_CACHE_DIRECTORY to use the '
+                'disk media cache, somewhere outside of MEDIA_ROOT')
+        self.max_bytes = max_bytes or \
+            settings.SKYLARK_MEDIA_CACHE_DISK_MAX_BYTES
+        self.__lock = threading.Lock()
+        # Written since we last pruned, we look again every tenth of
+        # max_bytes
+        self.__written = 0
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        try:
+            f = open(self._filename(key), 'rb')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+        try:
+            return f.read().decode('utf-8')
+        finally:
+            f.close()
+
+    def set(self, key, source):
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        publish.write_file(self._filename(key), source)
+
+        self.__lock.acquire()
+        try:
+            self.__written += len(source)
+            prune = self.__written * 10 >= self.max_bytes
+            if prune:
+                self.__written = 0
+        finally:
+            self.__lock.release()
+
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Removes the oldest files until the rest fit in max_bytes
+        """
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                filename = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    # Another process got to it first
+                    continue
+                entries.append((st.st_mtime, filename, st.st_size))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, filename, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                os.remove(os.path.join(dirpath, filename))
+
+
+class DjangoMediaCache(BaseMediaCache):
+    """
+    Uses whatever CACHE_BACKEND is
+    """
+    prefix = 'skylark.media.'
+
+    def __init__(self):
+        from django.core.cache import cache
+        self.cache = cache
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, source):
+        self.cache.set(self.prefix + key, source)
+
+    def clear(self):
+        # The cache framework can't clear just our keys, they're keyed by
+        # content so they won't be used again anyway
+        pass
+
+
+backends = {
+    'locmem': LocMemMediaCache,
+    'disk': DiskMediaCache,
+    'django': DjangoMediaCache,
+}
+
+
+def get_media_cache():
+    global __media_cache
+
+    backend = settings.SKYLARK_MEDIA_CACHE
+    if __media_cache is None or __media_cache[0] != backend:
+        if backend in backends:
+            cache_class = backends[backend]
+        else:
+            module, attr = backend.rsplit('.', 1)
+            cache_class = getattr(import_module(module), attr)
+        __media_cache = (backend, cache_class())
+
+    return __media_cache[1]
+
+
+def clear_media_cache():
+    get_media_cache().clear()
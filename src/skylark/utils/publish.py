@@ -0,0 +1,144 @@
+"""
+Puts files that don't need any processing into the cache.
+
+How we do that is up to SKYLARK_PUBLISH_STRATEGY:
+
+    copy        A copy of the file, this works everywhere
+    hardlink    A hard link to the file, falls back to a copy if the cache is
+                on another file system
+    symlink     A symbolic link to the file, your web server has to be willing
+                to follow them
+
+Either way the file is created with a temporary name and renamed into place so
+nobody sees it half done.  write_file does the same for the files we build.
+"""
+import os
+import errno
+import shutil
+import thread
+
+from skylark.conf import settings
+
+STRATEGIES = ('copy', 'hardlink', 'symlink',)
+
+
+def get_strategy(strategy=None):
+    strategy = strategy or settings.SKYLARK_PUBLISH_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError('SKYLARK_PUBLISH_STRATEGY must be one of %s, not %r'
+            % (', '.join(STRATEGIES), strategy))
+    return strategy
+
+
+def make_directory(dirname):
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def get_temporary_name(destination):
+    """
+    A name next to destination that no other process or thread will use
+    """
+    return '%s.%d.%d.tmp' % (destination, os.getpid(), thread.get_ident())
+
+
+def _copy(source, destination):
+    shutil.copy2(source, destination)
+
+
+def _hardlink(source, destination):
+    try:
+        os.link(source, destination)
+    except (OSError, AttributeError):
+        # Another file system, or a platform without hard links
+        _copy(source, destination)
+
+
+def _symlink(source, destination):
+    os.symlink(os.path.abspath(source), destination)
+
+
+publishers = {
+    'copy': _copy,
+    'hardlink': _hardlink,
+    'symlink': _symlink,
+}
+
+
+def is_published(source, destination, strategy=None):
+    """
+    True if destination is already a link to source.  There is no cheap way to
+    tell for a copy, so that is always False.
+    """
+    strategy = get_strategy(strategy)
+    try:
+        if strategy == 'symlink':
+            return os.path.islink(destination) and \
+                os.readlink(destination) == os.path.abspath(source)
+        if strategy == 'hardlink':
+            return os.path.samefile(source, destination)
+    except OSError:
+        pass
+    return False
+
+
+def is_current(source, destination, strategy=None):
+    """
+    True if destination doesn't need publishing again, it's a link to source
+    or a copy with the same size and modified time.  A hard link that had to
+    fall back to a copy counts as a copy.
+    """
+    strategy = get_strategy(strategy)
+    if is_published(source, destination, strategy):
+        return True
+    if strategy == 'symlink' or os.path.islink(destination):
+        return False
+    try:
+        source_stat = os.stat(source)
+        destination_stat = os.stat(destination)
+    except OSError:
+        return False
+    # Copying loses some of the precision of the modified time
+    return source_stat.st_size == destination_stat.st_size and \
+        int(source_stat.st_mtime) == int(destination_stat.st_mtime)
+
+
+def publish(source, destination, strategy=None):
+    """
+    Puts source at destination by copying or linking it
+    """
+    strategy = get_strategy(strategy)
+    make_directory(os.path.dirname(destination))
+
+    tmp_destination = get_temporary_name(destination)
+    if os.path.lexists(tmp_destination):
+        os.remove(tmp_destination)
+    publishers[strategy](source, tmp_destination)
+    os.rename(tmp_destination, destination)
+
+
+def write_file(filename, content):
+    """
+    Writes content to filename by way of a temporary file, anybody reading
+    filename sees either the old content or the new content and nothing in
+    between
+    """
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+
+    make_directory(os.path.dirname(filename))
+
+    tmp_filename = get_temporary_name(filename)
+    f = open(tmp_filename, 'wb')
+    try:
+        f.write(content)
+    except:
+        f.close()
+        os.remove(tmp_filename)
+        raise
+    f.close()
+    os.rename(tmp_filename, filename)
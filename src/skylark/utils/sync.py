@@ -0,0 +1,183 @@
+"""
+Keeps a copy of a directory up to date without copying the whole thing.
+
+For each destination we keep a small manifest of the files we published there
+with their size, modified time, and a digest of their content.  When we sync
+again only the files that changed are copied and only the files that went
+away are removed.  A file that was touched but not changed is left alone.
+
+Files are published (copied or linked, see skylark.utils.publish) to a
+temporary name in the destination and renamed into place, so a web server
+never sees half of an image.
+"""
+import os
+import json
+import errno
+import hashlib
+
+from skylark.conf import settings
+from skylark.utils import publish
+
+MANIFEST_DIRECTORY = '.sync'
+
+
+class SyncReport(object):
+    """
+    What sync_directory did
+    """
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+        self.added = []
+        self.updated = []
+        self.removed = []
+        self.unchanged = []
+
+    @property
+    def changed(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def __repr__(self):
+        return '<SyncReport %s: %d added, %d updated, %d removed, ' \
+            '%d unchanged>' % (self.destination, len(self.added),
+            len(self.updated), len(self.removed), len(self.unchanged))
+
+
+def file_digest(filename):
+    digest = hashlib.md5()
+    f = open(filename, 'rb')
+    try:
+        while True:
+            chunk = f.read(65536)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+def get_manifest_filename(destination):
+    """
+    Where we keep the manifest for destination, these live in the cache root
+    so they don't show up in the directories we publish
+    """
+    name = hashlib.md5(os.path.abspath(destination)).hexdigest()
+    return os.path.join(settings.SKYLARK_CACHE_ROOT, MANIFEST_DIRECTORY,
+        '%s.json' % name)
+
+
+def read_manifest(filename):
+    try:
+        f = open(filename)
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return {}
+
+
+def write_manifest(filename, manifest):
+    publish.write_file(filename, json.dumps(manifest))
+
+
+def remove_file(destination, root):
+    """
+    Removes destination and any directories that are empty because of it, up
+    to but not including root
+    """
+    try:
+        os.remove(destination)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    dirname = os.path.dirname(destination)
+    while dirname.startswith(root) and dirname != root:
+        try:
+            os.rmdir(dirname)
+        except OSError:
+            # Not empty
+            break
+        dirname = os.path.dirname(dirname)
+
+
+def scan_directory(source):
+    """
+    Gives back {relpath: (size, mtime)} for each file in source
+    """
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(source, followlinks=True):
+        relpath = os.path.relpath(dirpath, source)
+        for filename in filenames:
+            if relpath == os.curdir:
+                name = filename
+            else:
+                name = os.path.join(relpath, filename)
+            st = os.stat(os.path.join(dirpath, filename))
+            found[name] = (st.st_size, st.st_mtime)
+    return found
+
+
+def sync_directory(source, destination, manifest_filename=None,
+                   strategy=None):
+    """
+    Makes destination look like source, publishing only what has changed since
+    the last time.  Gives back a SyncReport.
+
+    strategy is one of the publish strategies, SKYLARK_PUBLISH_STRATEGY if it's
+    None.  Changing the strategy publishes everything again.
+    """
+    source = os.path.abspath(source)
+    destination = os.path.abspath(destination)
+    strategy = publish.get_strategy(strategy)
+
+    if manifest_filename is None:
+        manifest_filename = get_manifest_filename(destination)
+
+    report = SyncReport(source, destination)
+    previous = read_manifest(manifest_filename)
+    manifest = {}
+
+    for name, (size, mtime) in scan_directory(source).items():
+        source_file = os.path.join(source, name)
+        destination_file = os.path.join(destination, name)
+        entry = previous.get(name)
+        published = os.path.isfile(destination_file)
+
+        if entry and entry[3:] != [strategy]:
+            # Published some other way, do it again
+            published = False
+
+        if entry and published and entry[0] == size and entry[1] == mtime:
+            manifest[name] = entry
+            report.unchanged.append(name)
+            continue
+
+        digest = file_digest(source_file)
+
+        if entry and published and entry[2] == digest:
+            # Touched but not changed
+            manifest[name] = [size, mtime, digest, strategy]
+            report.unchanged.append(name)
+            continue
+
+        publish.publish(source_file, destination_file, strategy)
+        manifest[name] = [size, mtime, digest, strategy]
+
+        if entry:
+            report.updated.append(name)
+        else:
+            report.added.append(name)
+
+    for name in previous:
+        if name in manifest:
+            continue
+        remove_file(os.path.join(destination, name), destination)
+        report.removed.append(name)
+
+    if manifest != previous:
+        write_manifest(manifest_filename, manifest)
+
+    return report
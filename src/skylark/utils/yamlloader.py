@@ -0,0 +1,81 @@
+"""
+Parses the YAML that comes out of the page instruction templates.
+
+We use the libyaml based CSafeLoader when PyYAML was built with it, falling
+back to the pure Python SafeLoader.  Neither one of these will construct
+arbitrary Python objects.
+
+Parsed documents are kept in a LRU cache keyed on a hash of the YAML text.
+Most YAML files render to exactly the same text on every request so we only
+need to parse them once per process.
+"""
+import copy
+import hashlib
+
+import yaml
+
+from django.utils.importlib import import_module
+
+from skylark.conf import settings
+from skylark.utils.lru import LRUCache
+
+try:
+    DefaultLoader = yaml.CSafeLoader
+except AttributeError:
+    # PyYAML was built without libyaml
+    DefaultLoader = yaml.SafeLoader
+
+__document_cache = None
+
+
+def get_loader():
+    """
+    The loader class to use, SKYLARK_YAML_LOADER can be set to a loader class
+    or the dotted path to one
+    """
+    loader = settings.SKYLARK_YAML_LOADER
+
+    if not loader:
+        return DefaultLoader
+
+    if isinstance(loader, basestring):
+        module, attr = loader.rsplit('.', 1)
+        return getattr(import_module(module), attr)
+
+    return loader
+
+
+def get_document_cache():
+    global __document_cache
+    if __document_cache is None:
+        __document_cache = LRUCache(settings.SKYLARK_YAML_CACHE_SIZE)
+    return __document_cache
+
+
+def clear_document_cache():
+    get_document_cache().clear()
+
+
+def load(source, loader=None):
+    """
+    Parses the YAML in source, giving back a copy the caller is free to modify
+    """
+    if loader is None:
+        loader = get_loader()
+
+    # The C loader won't take subclasses of str or unicode (like the SafeUnicode
+    # that comes back from rendering a template) so we hand it a plain string
+    if isinstance(source, unicode):
+        encoded = unicode.encode(source, 'utf-8')
+    else:
+        encoded = str.__str__(source)
+
+    cache = get_document_cache()
+    key = (loader, hashlib.md5(encoded).hexdigest())
+
+    document = cache.get(key)
+    if document is None:
+        document = yaml.load(encoded, Loader=loader)
+        cache.set(key, document)
+
+    return copy.deepcopy(document)
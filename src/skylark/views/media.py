@@ -0,0 +1,77 @@
+import os
+import re
+import time
+import urllib
+import posixpath
+
+from django.utils.http import http_date
+from django.views import static
+
+from skylark.conf import settings
+from skylark.plans.base import content_digest
+from skylark.utils.lru import LRUCache
+
+# A year, which is as far as HTTP/1.1 servers should go
+FAR_FUTURE = 365 * 24 * 60 * 60
+
+# Rollups are named with a digest of their content, 0123...cdef.css, and
+# blog/screen.css becomes blog/screen.0123456789ab.css if the
+# fingerprint_static plan option is on
+fingerprinted_re = re.compile(
+    r'(?:^|/)(?:([0-9a-f]{32})|[^/]+\.([0-9a-f]{12}))\.\w+$')
+
+# (filename, modified time, size) -> does the digest in the name match
+__checked = LRUCache(1000)
+
+
+def is_fingerprinted(path, document_root=None):
+    """
+    Files with a digest of their content in their name never change, a change
+    to the content means a new name.  A name that only looks like it has a
+    digest in it isn't enough, it has to match what's in the file.
+    """
+    match = fingerprinted_re.search(path)
+    if not match:
+        return False
+    digest = match.group(1) or match.group(2)
+
+    filename = os.path.join(document_root or settings.SKYLARK_CACHE_ROOT,
+        posixpath.normpath(urllib.unquote(path)).lstrip('/'))
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+
+    key = (filename, st.st_mtime, st.st_size)
+    matches = __checked.get(key)
+    if matches is None:
+        try:
+            f = open(filename, 'rb')
+            try:
+                matches = content_digest(f.read()).startswith(digest)
+            finally:
+                f.close()
+        except IOError:
+            return False
+        __checked.set(key, matches)
+
+    return matches
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """
+    Serves files from the Django Skylark cache, telling the browser it can keep
+    the ones that are named by their content forever.  Like
+    django.views.static.serve this is for development and small sites, your web
+    server can do the same thing much faster.
+
+        (r'^media/cfcache/(?P<path>.*)$', 'skylark.views.media.serve'),
+    """
+    document_root = document_root or settings.SKYLARK_CACHE_ROOT
+    response = static.serve(request, path, document_root, show_indexes)
+
+    if response.status_code == 200 and is_fingerprinted(path, document_root):
+        response['Cache-Control'] = 'public, max-age=%d' % FAR_FUTURE
+        response['Expires'] = http_date(time.time() + FAR_FUTURE)
+
+    return response
@@ -0,0 +1,292 @@
+"""
+Keeps an eye on the files behind the media we have prepared.
+
+Without a watcher the plans stat every file in a rollup on every request to
+find out if it needs to be built again.  A watcher does that work in the
+background (or lets the kernel do it with inotify) so that the request only
+has to ask if anything changed.
+
+Files are watched in groups, a rollup for example is one group.  A group is
+changed if any of its files have been modified, removed, or replaced since the
+group was last watched.
+
+    SKYLARK_MEDIA_WATCHER = 'auto'    # inotify if we can, otherwise polling
+"""
+import os
+import time
+import logging
+import threading
+
+from skylark.conf import settings
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+__watcher = None
+
+logger = logging.getLogger('skylark.watcher')
+
+
+class BaseWatcher(object):
+    def __init__(self):
+        self._lock = threading.RLock()
+        # group -> list of paths
+        self._groups = {}
+        # path -> set of groups
+        self._paths = {}
+        self._changed = set()
+        self._pid = None
+
+    def watch(self, group, paths):
+        """
+        Starts watching paths as group, replacing whatever was in the group
+        before and clearing its changed flag
+        """
+        self._ensure_running()
+
+        self._lock.acquire()
+        try:
+            self._forget(group)
+            paths = [os.path.abspath(path) for path in paths]
+            self._groups[group] = paths
+            for path in paths:
+                self._paths.setdefault(path, set()).add(group)
+                self._start_watching(path)
+            self._changed.discard(group)
+        finally:
+            self._lock.release()
+
+    def extend(self, group, paths):
+        """
+        Adds paths to a group we are already watching without clearing its
+        changed flag
+        """
+        self._lock.acquire()
+        try:
+            if group not in self._groups:
+                return
+            for path in paths:
+                path = os.path.abspath(path)
+                if path in self._groups[group]:
+                    continue
+                self._groups[group].append(path)
+                self._paths.setdefault(path, set()).add(group)
+                self._start_watching(path)
+        finally:
+            self._lock.release()
+
+    def unwatch(self, group):
+        self._lock.acquire()
+        try:
+            self._forget(group)
+        finally:
+            self._lock.release()
+
+    def is_watching(self, group):
+        return group in self._groups
+
+    def changed(self, group):
+        """
+        True if the group has changed since we started watching it, or if we
+        aren't watching it at all
+        """
+        if self._pid != os.getpid():
+            # We've been forked, our thread didn't come with us
+            return True
+        return group not in self._groups or group in self._changed
+
+    def file_changed(self, path):
+        """
+        Flags every group with path in it as changed
+        """
+        self._lock.acquire()
+        try:
+            for group in self._paths.get(path, ()):
+                self._changed.add(group)
+        finally:
+            self._lock.release()
+
+    def all_changed(self):
+        """
+        Flags every group as changed, for when we can't tell what changed
+        """
+        self._lock.acquire()
+        try:
+            self._changed.update(self._groups)
+        finally:
+            self._lock.release()
+
+    def _forget(self, group):
+        for path in self._groups.pop(group, ()):
+            groups = self._paths.get(path)
+            if groups is None:
+                continue
+            groups.discard(group)
+            if not groups:
+                del self._paths[path]
+                self._stop_watching(path)
+        self._changed.discard(group)
+
+    def _ensure_running(self):
+        if self._pid == os.getpid():
+            return
+        self._lock.acquire()
+        try:
+            if self._pid == os.getpid():
+                return
+            # Anything we knew before a fork can't be trusted
+            self._groups = {}
+            self._paths = {}
+            self._changed = set()
+            self._start()
+            self._pid = os.getpid()
+        finally:
+            self._lock.release()
+
+    def _start(self):
+        raise NotImplementedError()
+
+    def _start_watching(self, path):
+        pass
+
+    def _stop_watching(self, path):
+        pass
+
+
+class PollingWatcher(BaseWatcher):
+    """
+    Stats the watched files from a background thread every interval seconds
+    """
+    def __init__(self, interval=1.0):
+        super(PollingWatcher, self).__init__()
+        self.interval = interval
+        self._mtimes = {}
+
+    def _start(self):
+        self._mtimes = {}
+        thread = threading.Thread(target=self._run,
+            name='skylark-media-watcher')
+        thread.setDaemon(True)
+        thread.start()
+
+    def _stat(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _start_watching(self, path):
+        self._mtimes[path] = self._stat(path)
+
+    def _stop_watching(self, path):
+        self._mtimes.pop(path, None)
+
+    def _run(self):
+        while True:
+            try:
+                time.sleep(self.interval)
+                self.poll()
+            except Exception:
+                if os is None:
+                    # The interpreter is shutting down around us
+                    return
+                # Whatever we missed, the plans will find by looking at the
+                # files themselves.  Keep going so they don't have to next
+                # time.
+                logger.exception('Could not poll for changed media')
+                self.all_changed()
+
+    def poll(self):
+        self._lock.acquire()
+        try:
+            watched = self._mtimes.items()
+        finally:
+            self._lock.release()
+
+        for path, mtime in watched:
+            current = self._stat(path)
+            if current != mtime:
+                self._lock.acquire()
+                try:
+                    if path in self._mtimes:
+                        self._mtimes[path] = current
+                finally:
+                    self._lock.release()
+                self.file_changed(path)
+
+
+class InotifyWatcher(BaseWatcher):
+    """
+    Has the kernel tell us when files change, requires pyinotify
+    """
+    if pyinotify:
+        mask = pyinotify.IN_MODIFY | pyinotify.IN_ATTRIB | \
+            pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+            pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE | \
+            pyinotify.IN_CREATE
+
+    def __init__(self):
+        if pyinotify is None:
+            raise ImportError('The inotify watcher needs pyinotify')
+        super(InotifyWatcher, self).__init__()
+        self._directories = {}
+
+    def _start(self):
+        self._directories = {}
+        self._manager = pyinotify.WatchManager()
+        notifier = pyinotify.ThreadedNotifier(self._manager, self._event)
+        notifier.setDaemon(True)
+        notifier.start()
+
+    def _event(self, event):
+        self.file_changed(event.pathname)
+        # Something in the directory changed, for those watching it
+        self.file_changed(event.path)
+
+    def _start_watching(self, path):
+        # We watch directories, editors like to replace files instead of
+        # changing them
+        directory = os.path.dirname(path)
+        if directory in self._directories:
+            self._directories[directory][1] += 1
+            return
+        wdd = self._manager.add_watch(directory, self.mask)
+        self._directories[directory] = [wdd.get(directory), 1]
+
+    def _stop_watching(self, path):
+        directory = os.path.dirname(path)
+        entry = self._directories.get(directory)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._directories[directory]
+            if entry[0] is not None and entry[0] >= 0:
+                self._manager.rm_watch(entry[0])
+
+
+def get_watcher():
+    """
+    The watcher for this process according to SKYLARK_MEDIA_WATCHER, None if
+    we aren't supposed to use one
+    """
+    global __watcher
+
+    kind = settings.SKYLARK_MEDIA_WATCHER
+    if not kind:
+        return None
+
+    if __watcher is None or __watcher.kind != kind:
+        if kind == 'inotify' or (kind == 'auto' and pyinotify):
+            watcher = InotifyWatcher()
+        elif kind in ('poll', 'auto'):
+            watcher = PollingWatcher(settings.SKYLARK_MEDIA_WATCHER_INTERVAL)
+        else:
+            raise ValueError('SKYLARK_MEDIA_WATCHER must be one of auto, '
+                'inotify, or poll, not %r' % kind)
+        watcher.kind = kind
+        __watcher = watcher
+
+    return __watcher